@@ -1,3 +1,6 @@
+-- pg_trgm: триграммный поиск по названиям и серийным номерам (/api/search)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE TABLE roles (
     id SERIAL PRIMARY KEY,
     name VARCHAR(32) NOT NULL
@@ -16,9 +19,16 @@ CREATE TABLE ships (
     name VARCHAR(32) NOT NULL,
     imo_number VARCHAR(50) UNIQUE,
     type VARCHAR(32),
-    owner_company VARCHAR(32)
+    owner_company VARCHAR(32),
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Поиск /api/search: префикс по lower(...) COLLATE "C" с упорядоченным обходом индекса, опечатки по триграммам.
+-- Выражения должны совпадать с search_key() в api.py, иначе индексы не используются
+CREATE INDEX idx_ships_name_prefix ON ships ((lower(name) COLLATE "C"), id);
+CREATE INDEX idx_ships_imo_prefix ON ships ((lower(imo_number) COLLATE "C"), id);
+CREATE INDEX idx_ships_name_trgm ON ships USING gist (name gist_trgm_ops);
+
 CREATE TABLE component_types (
     id SERIAL PRIMARY KEY,
     name VARCHAR(32) NOT NULL UNIQUE
@@ -32,21 +42,42 @@ CREATE TABLE components (
     serial_number VARCHAR(50),
     service_life_months INTEGER NOT NULL,
     last_inspection_date DATE NOT NULL,
-    status VARCHAR(32) NOT NULL
+    status VARCHAR(32) NOT NULL,
+    expiration_date DATE,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    history_version BIGINT NOT NULL DEFAULT 0
 );
 
+-- expiration_date поддерживается триггером auto_update_inspection_date,
+-- history_version (валидатор истории компонента для ETag) - триггером component_updates_history_version
+CREATE INDEX idx_components_status_expiration ON components (status, expiration_date);
+CREATE INDEX idx_components_expiration ON components (expiration_date, id);
+CREATE INDEX idx_components_ship_id ON components (ship_id, id);
+CREATE INDEX idx_components_name_prefix ON components ((lower(name) COLLATE "C"), id);
+CREATE INDEX idx_components_serial_prefix ON components ((lower(serial_number) COLLATE "C"), id);
+CREATE INDEX idx_components_name_trgm ON components USING gist (name gist_trgm_ops);
+
+-- Журналы component_updates и component_audit разбиты на месячные секции <таблица>_pYYYY_MM,
+-- их заранее создает ensure_history_partitions(), устаревшие отсоединяет detach_expired_history_partitions().
+-- Секции DEFAULT нет: с ней планировщик не может обходить секции по порядку дат и останавливаться
+-- на LIMIT, и история компонента читалась бы из всех секций. Первичный ключ обязан включать ключ секционирования
 CREATE TABLE component_updates (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     component_id INTEGER NOT NULL REFERENCES components(id) ON DELETE CASCADE,
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE SET NULL,
     update_name VARCHAR(32) NOT NULL,
     update_date DATE NOT NULL,
     new_status VARCHAR(32) NOT NULL,
-    notes TEXT
-);
+    notes TEXT,
+    PRIMARY KEY (id, update_date)
+) PARTITION BY RANGE (update_date);
+
+CREATE INDEX idx_component_updates_component ON component_updates (component_id, update_date DESC, id DESC);
+CREATE INDEX idx_component_updates_date ON component_updates USING brin (update_date);
+CREATE INDEX idx_component_updates_user ON component_updates (user_id, update_name);
 
 CREATE TABLE component_audit (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     component_id INTEGER NOT NULL,
     operation_type VARCHAR(10) NOT NULL,
     old_name VARCHAR(32),
@@ -56,9 +87,31 @@ CREATE TABLE component_audit (
     old_last_inspection_date DATE,
     new_last_inspection_date DATE,
     user_id INTEGER REFERENCES users(id),
-    change_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    change_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, change_time)
+) PARTITION BY RANGE (change_time);
+
+CREATE INDEX idx_component_audit_change_time ON component_audit USING brin (change_time);
+
+CREATE TABLE ship_deletion_jobs (
+    id SERIAL PRIMARY KEY,
+    ship_id INTEGER NOT NULL,
+    ship_name VARCHAR(32) NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(16) NOT NULL,
+    components_decommissioned INTEGER,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    -- Процесс, выполняющий задание, и время его последнего сигнала: по ним находятся задания умерших процессов
+    worker_host VARCHAR(255),
+    worker_pid INTEGER,
+    heartbeat_at TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0
 );
 
+CREATE INDEX idx_ship_deletion_jobs_active ON ship_deletion_jobs (status) WHERE status IN ('pending', 'running');
+
 CREATE TABLE component_subscriptions (
     id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
@@ -66,6 +119,36 @@ CREATE TABLE component_subscriptions (
     UNIQUE (user_id, component_type_id)
 );
 
+-- Что бот уже отправил подписчику: компонент, порог (90/30/7/0 дней до истечения) и срок на момент отправки.
+-- Внешнего ключа на components нет: удаленный компонент должен попасть в сводку как снятый с контроля
+CREATE TABLE notification_state (
+    telegram_id BIGINT NOT NULL,
+    component_id INTEGER NOT NULL,
+    tier SMALLINT NOT NULL CHECK (tier IN (0, 7, 30, 90)),
+    expiration_date DATE NOT NULL,
+    notified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (telegram_id, component_id)
+);
+
+-- Сводка для /api/dashboard: число компонентов по судну, типу и статусу.
+-- Поддерживается триггерами apply_component_status_deltas; внешних ключей нет, чтобы каскадное
+-- удаление судна не мешало триггеру компонентов обнулить свои строки
+CREATE TABLE component_status_counts (
+    ship_id INTEGER NOT NULL,
+    component_type_id INTEGER NOT NULL,
+    status VARCHAR(32) NOT NULL,
+    component_count INTEGER NOT NULL,
+    PRIMARY KEY (ship_id, component_type_id, status)
+);
+
+-- Версии справочников для кэша API и валидаторы условных GET по спискам (ships).
+-- changed_at - время последнего изменения таблицы для Last-Modified
+CREATE TABLE cache_versions (
+    name VARCHAR(32) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Триггеры
 CREATE OR REPLACE FUNCTION public.check_component_status_update_permissions()
 RETURNS trigger
@@ -97,6 +180,8 @@ BEGIN
 END;
 $BODY$;
 
+-- Пользователь API передается в транзакцию через set_config('maritime.user_id', ..., true),
+-- журнал пишется одним INSERT ... SELECT на оператор из таблиц переходов
 CREATE OR REPLACE FUNCTION public.log_component_changes()
 RETURNS trigger
 LANGUAGE 'plpgsql'
@@ -104,25 +189,68 @@ COST 100
 VOLATILE NOT LEAKPROOF
 AS $BODY$
 DECLARE
-    current_user_id INTEGER;
+    current_user_id INTEGER := NULLIF(current_setting('maritime.user_id', true), '')::integer;
 BEGIN
-    SELECT id INTO current_user_id FROM users WHERE username = current_user;
+    -- Секции DEFAULT нет: без секции текущего месяца упала бы любая запись компонентов,
+    -- поэтому триггер создает ее сам, если обслуживание истории в API не успело
+    IF to_regclass(format('component_audit_p%s', to_char(CURRENT_DATE, 'YYYY_MM'))) IS NULL
+       OR to_regclass(format('component_updates_p%s', to_char(CURRENT_DATE, 'YYYY_MM'))) IS NULL THEN
+        PERFORM ensure_history_partitions(0);
+    END IF;
 
     IF TG_OP = 'INSERT' THEN
         INSERT INTO component_audit (component_id, operation_type, new_name, new_status,
                                     new_last_inspection_date, user_id)
-        VALUES (NEW.id, 'INSERT', NEW.name, NEW.status, NEW.last_inspection_date, current_user_id);
+        SELECT n.id, 'INSERT', n.name, n.status, n.last_inspection_date, current_user_id
+        FROM new_rows n
+        ORDER BY n.id;
     ELSIF TG_OP = 'UPDATE' THEN
-        IF OLD.name <> NEW.name OR OLD.status <> NEW.status OR OLD.last_inspection_date <>
-           NEW.last_inspection_date THEN
-            INSERT INTO component_audit (component_id, operation_type, old_name, new_name, old_status,
-                                        new_status, old_last_inspection_date, new_last_inspection_date, user_id)
-            VALUES (NEW.id, 'UPDATE', OLD.name, NEW.name, OLD.status, NEW.status,
-                    OLD.last_inspection_date, NEW.last_inspection_date, current_user_id);
-        END IF;
+        INSERT INTO component_audit (component_id, operation_type, old_name, new_name, old_status,
+                                    new_status, old_last_inspection_date, new_last_inspection_date, user_id)
+        SELECT n.id, 'UPDATE', o.name, n.name, o.status, n.status,
+               o.last_inspection_date, n.last_inspection_date, current_user_id
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE o.name IS DISTINCT FROM n.name OR o.status IS DISTINCT FROM n.status
+           OR o.last_inspection_date IS DISTINCT FROM n.last_inspection_date
+        ORDER BY n.id;
     END IF;
 
-    RETURN NEW;
+    RETURN NULL;
+END;
+$BODY$;
+
+-- Публикует в канал component_alerts id компонентов, перешедших в статус, требующий срочного внимания,
+-- или получивших запись истории с таким статусом. Бот слушает канал и рассылает уведомления подписчикам.
+-- id отправляются через запятую пачками по 500: полезная нагрузка NOTIFY ограничена 8000 байт,
+-- а одинаковые уведомления в одной транзакции PostgreSQL объединяет сам
+CREATE OR REPLACE FUNCTION public.notify_component_alerts()
+RETURNS trigger
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE NOT LEAKPROOF
+AS $BODY$
+BEGIN
+    IF TG_TABLE_NAME = 'components' THEN
+        PERFORM pg_notify('component_alerts', string_agg(changed.id::text, ',' ORDER BY changed.id))
+        FROM (
+            SELECT n.id, (row_number() OVER (ORDER BY n.id) - 1) / 500 AS chunk
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            WHERE n.status IN ('Неисправен', 'Требует проверки')
+              AND o.status IS DISTINCT FROM n.status
+        ) changed
+        GROUP BY changed.chunk;
+    ELSE
+        PERFORM pg_notify('component_alerts', string_agg(changed.component_id::text, ',' ORDER BY changed.component_id))
+        FROM (
+            SELECT n.component_id, (row_number() OVER (ORDER BY n.component_id) - 1) / 500 AS chunk
+            FROM (SELECT DISTINCT component_id FROM new_rows WHERE new_status IN ('Неисправен', 'Требует проверки')) n
+        ) changed
+        GROUP BY changed.chunk;
+    END IF;
+
+    RETURN NULL;
 END;
 $BODY$;
 
@@ -148,9 +276,10 @@ COST 100
 VOLATILE NOT LEAKPROOF
 AS $BODY$
 BEGIN
-    IF NEW.status <> OLD.status THEN
+    IF TG_OP = 'UPDATE' AND NEW.status <> OLD.status THEN
         NEW.last_inspection_date = CURRENT_DATE;
     END IF;
+    NEW.expiration_date = (NEW.last_inspection_date + NEW.service_life_months * INTERVAL '1 month')::date;
     RETURN NEW;
 END;
 $BODY$;
@@ -170,16 +299,164 @@ BEGIN
 END;
 $BODY$;
 
+CREATE OR REPLACE FUNCTION public.bump_cache_version()
+RETURNS trigger
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE NOT LEAKPROOF
+AS $BODY$
+BEGIN
+    UPDATE cache_versions SET version = version + 1, changed_at = clock_timestamp() WHERE name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.bump_component_history_version()
+RETURNS trigger
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE NOT LEAKPROOF
+AS $BODY$
+BEGIN
+    -- Одна строка components на компонент оператора: общего счетчика по всей истории нет,
+    -- чтобы параллельные записи истории разных компонентов не ждали друг друга
+    UPDATE components c
+    SET history_version = c.history_version + k.added
+    FROM (SELECT component_id, COUNT(*) AS added FROM new_rows GROUP BY component_id) k
+    WHERE c.id = k.component_id;
+    RETURN NULL;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.touch_updated_at()
+RETURNS trigger
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE NOT LEAKPROOF
+AS $BODY$
+BEGIN
+    NEW.updated_at = clock_timestamp();
+    RETURN NEW;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.apply_component_status_deltas()
+RETURNS trigger
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE NOT LEAKPROOF
+AS $BODY$
+BEGIN
+    -- Один проход по строкам оператора: изменения сворачиваются до разностей по ключу сводки
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO component_status_counts AS s (ship_id, component_type_id, status, component_count)
+        SELECT ship_id, component_type_id, status, COUNT(*)
+        FROM new_rows
+        GROUP BY ship_id, component_type_id, status
+        ORDER BY ship_id, component_type_id, status
+        ON CONFLICT (ship_id, component_type_id, status)
+        DO UPDATE SET component_count = s.component_count + EXCLUDED.component_count;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO component_status_counts AS s (ship_id, component_type_id, status, component_count)
+        SELECT ship_id, component_type_id, status, -COUNT(*)
+        FROM old_rows
+        GROUP BY ship_id, component_type_id, status
+        ORDER BY ship_id, component_type_id, status
+        ON CONFLICT (ship_id, component_type_id, status)
+        DO UPDATE SET component_count = s.component_count + EXCLUDED.component_count;
+    ELSE
+        INSERT INTO component_status_counts AS s (ship_id, component_type_id, status, component_count)
+        SELECT ship_id, component_type_id, status, SUM(delta)
+        FROM (
+            SELECT ship_id, component_type_id, status, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT ship_id, component_type_id, status, -1 AS delta FROM old_rows
+        ) AS changes
+        GROUP BY ship_id, component_type_id, status
+        HAVING SUM(delta) <> 0
+        ORDER BY ship_id, component_type_id, status
+        ON CONFLICT (ship_id, component_type_id, status)
+        DO UPDATE SET component_count = s.component_count + EXCLUDED.component_count;
+    END IF;
+
+    -- Обнулиться могут только уменьшенные ключи, поэтому проверяются лишь ключи из old_rows
+    DELETE FROM component_status_counts s
+    USING (SELECT DISTINCT ship_id, component_type_id, status FROM old_rows) k
+    WHERE s.ship_id = k.ship_id
+      AND s.component_type_id = k.component_type_id
+      AND s.status = k.status
+      AND s.component_count = 0;
+    RETURN NULL;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.check_component_status_counts(
+    repair boolean DEFAULT false)
+RETURNS TABLE(ship_id integer, component_type_id integer, status character varying, expected integer, actual integer)
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE PARALLEL UNSAFE
+AS $BODY$
+BEGIN
+    -- Пересчитывает сводку полным проходом по components и возвращает расхождения;
+    -- при repair = true исправляет их. Блокировка не дает изменить компоненты во время сверки
+    IF repair THEN
+        LOCK TABLE components IN SHARE MODE;
+    END IF;
+
+    CREATE TEMP TABLE component_status_diff ON COMMIT DROP AS
+    SELECT coalesce(e.ship_id, a.ship_id) AS ship_id,
+           coalesce(e.component_type_id, a.component_type_id) AS component_type_id,
+           coalesce(e.status, a.status) AS status,
+           coalesce(e.component_count, 0)::integer AS expected,
+           coalesce(a.component_count, 0)::integer AS actual
+    FROM (
+        SELECT c.ship_id, c.component_type_id, c.status, COUNT(*) AS component_count
+        FROM components c
+        GROUP BY c.ship_id, c.component_type_id, c.status
+    ) AS e
+    FULL JOIN component_status_counts a
+        ON a.ship_id = e.ship_id AND a.component_type_id = e.component_type_id AND a.status = e.status
+    WHERE e.component_count IS DISTINCT FROM a.component_count;
+
+    IF repair THEN
+        DELETE FROM component_status_counts s
+        USING component_status_diff d
+        WHERE s.ship_id = d.ship_id AND s.component_type_id = d.component_type_id AND s.status = d.status;
+        INSERT INTO component_status_counts (ship_id, component_type_id, status, component_count)
+        SELECT d.ship_id, d.component_type_id, d.status, d.expected
+        FROM component_status_diff d
+        WHERE d.expected > 0;
+    END IF;
+
+    RETURN QUERY SELECT d.ship_id, d.component_type_id, d.status, d.expected, d.actual
+    FROM component_status_diff d
+    ORDER BY d.ship_id, d.component_type_id, d.status;
+    DROP TABLE component_status_diff;
+END;
+$BODY$;
+
 CREATE TRIGGER component_insert_audit
 AFTER INSERT ON components
-FOR EACH ROW
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
 EXECUTE FUNCTION log_component_changes();
 
 CREATE TRIGGER component_update_audit
 AFTER UPDATE ON components
-FOR EACH ROW
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
 EXECUTE FUNCTION log_component_changes();
 
+CREATE TRIGGER component_status_alert
+AFTER UPDATE ON components
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_component_alerts();
+
 CREATE TRIGGER check_component_status
 BEFORE INSERT OR UPDATE ON components
 FOR EACH ROW
@@ -191,7 +468,7 @@ FOR EACH ROW
 EXECUTE FUNCTION prevent_component_deletion();
 
 CREATE TRIGGER auto_update_inspection_date
-BEFORE UPDATE ON components
+BEFORE INSERT OR UPDATE ON components
 FOR EACH ROW
 EXECUTE FUNCTION update_last_inspection_date();
 
@@ -200,44 +477,95 @@ BEFORE INSERT OR UPDATE ON component_updates
 FOR EACH ROW
 EXECUTE FUNCTION check_component_status_update_permissions();
 
+CREATE TRIGGER component_update_alert
+AFTER INSERT ON component_updates
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_component_alerts();
+
+CREATE TRIGGER component_updates_history_version
+AFTER INSERT ON component_updates
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_component_history_version();
+
+CREATE TRIGGER ships_touch_updated_at
+BEFORE UPDATE ON ships
+FOR EACH ROW
+EXECUTE FUNCTION touch_updated_at();
+
+CREATE TRIGGER components_touch_updated_at
+BEFORE UPDATE ON components
+FOR EACH ROW
+EXECUTE FUNCTION touch_updated_at();
+
+CREATE TRIGGER components_status_counts_insert
+AFTER INSERT ON components
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION apply_component_status_deltas();
+
+CREATE TRIGGER components_status_counts_update
+AFTER UPDATE ON components
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION apply_component_status_deltas();
+
+CREATE TRIGGER components_status_counts_delete
+AFTER DELETE ON components
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION apply_component_status_deltas();
+
+CREATE TRIGGER roles_cache_version
+AFTER INSERT OR UPDATE OR DELETE ON roles
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_cache_version();
+
+-- Только столбцы, которые кэширует get_user_cached: пересчет password_hash при входе не сбрасывает кэш
+CREATE TRIGGER users_cache_version
+AFTER INSERT OR UPDATE OF username, telegram_id, role_id OR DELETE ON users
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_cache_version();
+
+CREATE TRIGGER component_types_cache_version
+AFTER INSERT OR UPDATE OR DELETE ON component_types
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_cache_version();
+
+CREATE TRIGGER ships_cache_version
+AFTER INSERT OR UPDATE OR DELETE ON ships
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_cache_version();
+
 -- Функции
+-- Аналитические функции только читают данные: STABLE PARALLEL SAFE позволяет планировщику
+-- встраивать их и выполнять параллельно, фильтры по датам - диапазоны, отсекающие лишние секции
 CREATE OR REPLACE FUNCTION public.count_component_updates(
     start_date date,
     end_date date)
 RETURNS integer
-LANGUAGE 'plpgsql'
+LANGUAGE 'sql'
 COST 100
-VOLATILE PARALLEL UNSAFE
+STABLE PARALLEL SAFE
 AS $BODY$
-DECLARE
-    updates_count INTEGER;
-BEGIN
-    SELECT COUNT(*)
-    INTO updates_count
-    FROM component_updates
-    WHERE update_date BETWEEN start_date AND end_date;
-    RETURN updates_count;
-END;
+SELECT COUNT(*)::integer
+FROM component_updates
+WHERE update_date >= start_date AND update_date <= end_date;
 $BODY$;
 
 CREATE OR REPLACE FUNCTION public.get_avg_repair_time(
     user_id_param integer)
 RETURNS interval
-LANGUAGE 'plpgsql'
+LANGUAGE 'sql'
 COST 100
-VOLATILE PARALLEL UNSAFE
+STABLE PARALLEL SAFE
 AS $BODY$
-DECLARE
-    avg_time INTERVAL;
-BEGIN
-    SELECT AVG(update_date - c.last_inspection_date)
-    INTO avg_time
-    FROM component_updates cu
-    JOIN components c ON cu.component_id = c.id
-    WHERE cu.user_id = user_id_param
-    AND cu.update_name IN ('Ремонт', 'Аварийный ремонт', 'Замена');
-    RETURN avg_time;
-END;
+SELECT AVG(cu.update_date - c.last_inspection_date) * INTERVAL '1 day'
+FROM component_updates cu
+JOIN components c ON cu.component_id = c.id
+WHERE cu.user_id = user_id_param
+AND cu.update_name IN ('Ремонт', 'Аварийный ремонт', 'Замена');
 $BODY$;
 
 CREATE OR REPLACE FUNCTION public.is_valid_component_status(
@@ -261,6 +589,31 @@ BEGIN
 END;
 $BODY$;
 
+CREATE OR REPLACE FUNCTION public.quarter_start(
+    input_quarter integer,
+    input_year integer)
+RETURNS date
+LANGUAGE 'sql'
+IMMUTABLE PARALLEL SAFE
+AS $BODY$
+SELECT make_date(input_year, (input_quarter - 1) * 3 + 1, 1);
+$BODY$;
+
+-- Порог уведомления по числу дней до истечения срока
+CREATE OR REPLACE FUNCTION public.notification_tier(
+    days_remaining integer)
+RETURNS smallint
+LANGUAGE 'sql'
+IMMUTABLE PARALLEL SAFE
+AS $BODY$
+SELECT (CASE
+    WHEN days_remaining <= 0 THEN 0
+    WHEN days_remaining <= 7 THEN 7
+    WHEN days_remaining <= 30 THEN 30
+    ELSE 90
+END)::smallint;
+$BODY$;
+
 CREATE OR REPLACE FUNCTION public.top_component_issues_by_quarter(
     input_quarter integer,
     input_year integer,
@@ -268,7 +621,7 @@ CREATE OR REPLACE FUNCTION public.top_component_issues_by_quarter(
 RETURNS TABLE(component_type character varying, issue_count integer, most_common_issue character varying)
 LANGUAGE 'sql'
 COST 100
-VOLATILE PARALLEL UNSAFE
+STABLE PARALLEL SAFE
 ROWS 1000
 AS $BODY$
 SELECT
@@ -278,15 +631,126 @@ SELECT
 FROM component_updates cu
 JOIN components c ON cu.component_id = c.id
 JOIN component_types ct ON c.component_type_id = ct.id
-WHERE EXTRACT(QUARTER FROM cu.update_date) = input_quarter
-AND EXTRACT(YEAR FROM cu.update_date) = input_year
+WHERE cu.update_date >= quarter_start(input_quarter, input_year)
+AND cu.update_date < (quarter_start(input_quarter, input_year) + INTERVAL '3 months')::date
 AND cu.new_status = 'Неисправен'
 GROUP BY ct.name, cu.update_name
 ORDER BY issue_count DESC
 LIMIT input_limit;
 $BODY$;
 
+-- Число неисправностей по кварталам, типам компонентов и видам работ для отчетов за годы истории.
+-- Обновляется из API (REFRESH ... CONCURRENTLY раз в ANALYTICS_REFRESH_INTERVAL), время - в analytics_refreshes
+CREATE MATERIALIZED VIEW component_issues_by_quarter AS
+SELECT
+    date_trunc('quarter', cu.update_date)::date AS quarter_start,
+    c.component_type_id,
+    cu.update_name,
+    COUNT(*)::integer AS issue_count
+FROM component_updates cu
+JOIN components c ON cu.component_id = c.id
+WHERE cu.new_status = 'Неисправен'
+GROUP BY 1, 2, 3;
+
+CREATE UNIQUE INDEX idx_component_issues_by_quarter ON component_issues_by_quarter (quarter_start, component_type_id, update_name);
+
+CREATE TABLE analytics_refreshes (
+    view_name VARCHAR(64) PRIMARY KEY,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Отсоединенные секции истории. API выгружает их в HISTORY_ARCHIVE_DIR (csv.gz) и удаляет таблицу,
+-- пока archived_at пуст, таблица секции еще существует
+CREATE TABLE history_archives (
+    partition_name VARCHAR(63) PRIMARY KEY,
+    parent_table VARCHAR(63) NOT NULL,
+    range_start DATE NOT NULL,
+    range_end DATE NOT NULL,
+    detached_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    row_count BIGINT,
+    file_path TEXT,
+    archived_at TIMESTAMP
+);
+
+-- Создает недостающие месячные секции с месяца from_date до текущего месяца + months_ahead.
+-- Уже выгруженные месяцы не пересоздаются
+CREATE OR REPLACE FUNCTION public.ensure_history_partitions(
+    months_ahead integer DEFAULT 3,
+    from_date date DEFAULT CURRENT_DATE)
+RETURNS integer
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE NOT LEAKPROOF
+AS $BODY$
+DECLARE
+    parent text;
+    month_start date;
+    month_end date;
+    part_name text;
+    created integer := 0;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['component_updates', 'component_audit'] LOOP
+        month_start := date_trunc('month', LEAST(from_date, CURRENT_DATE))::date;
+        WHILE month_start <= date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead) LOOP
+            month_end := (month_start + INTERVAL '1 month')::date;
+            part_name := format('%s_p%s', parent, to_char(month_start, 'YYYY_MM'));
+            IF to_regclass(part_name) IS NULL
+               AND NOT EXISTS (SELECT 1 FROM history_archives a WHERE a.partition_name = part_name) THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               part_name, parent, month_start, month_end);
+                created := created + 1;
+            END IF;
+            month_start := month_end;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END;
+$BODY$;
+
+-- Отсоединяет месячные секции старше retention_months полных месяцев и записывает их в history_archives
+CREATE OR REPLACE FUNCTION public.detach_expired_history_partitions(
+    retention_months integer)
+RETURNS integer
+LANGUAGE 'plpgsql'
+COST 100
+VOLATILE NOT LEAKPROOF
+AS $BODY$
+DECLARE
+    expired record;
+    cutoff date := (date_trunc('month', CURRENT_DATE) - make_interval(months => retention_months))::date;
+    detached integer := 0;
+BEGIN
+    FOR expired IN
+        SELECT p.relname AS parent, c.relname AS part_name, to_date(right(c.relname, 7), 'YYYY_MM') AS month_start
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname IN ('component_updates', 'component_audit')
+          AND c.relname ~ '_p[0-9]{4}_[0-9]{2}$'
+          AND to_date(right(c.relname, 7), 'YYYY_MM') < cutoff
+        ORDER BY 3, 1
+    LOOP
+        EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', expired.parent, expired.part_name);
+        INSERT INTO history_archives (partition_name, parent_table, range_start, range_end)
+        VALUES (expired.part_name, expired.parent, expired.month_start, (expired.month_start + INTERVAL '1 month')::date);
+        detached := detached + 1;
+    END LOOP;
+    RETURN detached;
+END;
+$BODY$;
+
 -- Заполнение данными
+SELECT ensure_history_partitions(3, DATE '2023-01-01');
+
+INSERT INTO analytics_refreshes (view_name) VALUES
+('component_issues_by_quarter');
+
+INSERT INTO cache_versions (name) VALUES
+('roles'),
+('users'),
+('component_types'),
+('ships');
+
 INSERT INTO roles (name) VALUES
 ('Администратор'),
 ('Специалист'),
@@ -318,3 +782,5 @@ INSERT INTO component_updates (component_id, user_id, update_name, update_date,
 (1, 2, 'Плановая проверка', '2023-01-15', 'Рабочий', 'Проверка давления масла в норме'),
 (2, 2, 'Диагностика', '2023-03-20', 'Требует проверки', 'Обнаружены помехи в работе'),
 (3, 2, 'Замена антенны', '2023-02-10', 'Рабочий', 'Установлена новая антенна');
+
+REFRESH MATERIALIZED VIEW component_issues_by_quarter;
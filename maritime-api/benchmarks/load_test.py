@@ -0,0 +1,298 @@
+"""Нагрузочный тест основных сценариев API с отчетом по каждому эндпоинту.
+
+Сценарии выполняются по очереди, каждый --clients потоками в течение --duration секунд:
+    list           GET /api/ships, GET /api/ships/<id>/components (первые и следующие страницы)
+    detail         GET /api/ships/<id>, GET /api/components/<id>, GET /api/components/<id>/updates
+    expiring       GET /api/expiring_components
+    status_update  POST /api/components/<id>/update_status (меняет данные!)
+    login          POST /api/login
+
+Данные и пользователей готовит benchmarks/generate_fleet.py:
+
+    python benchmarks/load_test.py --url http://localhost:5252 --duration 20 --output results/$(git rev-parse --short HEAD).json
+    python benchmarks/load_test.py --compare results/abc1234.json
+
+Результат - JSON: задержки p50/p95/p99/max в мс и пропускная способность (успешных ответов в секунду)
+по каждому эндпоинту; с --compare добавляется изменение p95 и rps в процентах относительно прошлого прогона.
+Задержки считаются только по ответам 2xx/304, остальные статусы видны в statuses.
+
+Замеры на 1 vCPU (генератор нагрузки на той же машине), gunicorn 2 процесса x 4 потока, 8 клиентов, 10 с,
+флот generate_fleet.py по умолчанию:
+    GET /api/ships                           ~52 req/s, p50 ~36 ms, p99 ~57 ms
+    GET /api/ships/<id>/components           ~52 req/s, p50 ~31 ms, p99 ~51 ms
+    GET /api/ships/<id>                      ~27 req/s, p50 ~33 ms, p99 ~66 ms
+    GET /api/components/<id>                 ~27 req/s, p50 ~39 ms, p99 ~77 ms
+    GET /api/components/<id>/updates         ~27 req/s, p50 ~58 ms, p99 ~104 ms
+    GET /api/expiring_components             ~32 req/s, p50 ~53 ms, p99 ~111 ms
+    POST /api/components/<id>/update_status  ~48 req/s, p50 ~75 ms, p99 ~121 ms
+    POST /api/login                          ~7 req/s, p50 ~616 ms, p99 ~690 ms (PASSWORD_HASH_WORKERS=1 и
+                                             PASSWORD_HASH_QUEUE=1, входы сверх пула получали 503)
+"""
+import argparse
+import http.client
+import json
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+SCENARIOS = ('list', 'detail', 'expiring', 'status_update', 'login')
+STATUS_CHOICES = ('Рабочий', 'Требует проверки', 'Неисправен', 'В ремонте')
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p / 100))], 1)
+
+
+class Client:
+    """HTTP-клиент с keep-alive и cookie JWT, как у браузера."""
+
+    def __init__(self, url, accept_encoding=None):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.accept_encoding = accept_encoding
+        self.cookies = {}
+        self.retry_after = None
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        if self.accept_encoding:
+            headers['Accept-Encoding'] = self.accept_encoding
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in self.cookies.items())
+        if method != 'GET' and 'csrf_access_token' in self.cookies:
+            headers['X-CSRF-TOKEN'] = self.cookies['csrf_access_token']
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            return None, None
+        self.retry_after = response.getheader('Retry-After')
+        for header in response.msg.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, data
+
+    def json(self, method, path, body=None):
+        status, data = self.request(method, path, body)
+        return status, (json.loads(data) if status == 200 and data else None)
+
+
+class Pools:
+    """Идентификаторы судов и компонентов, по которым ходят сценарии."""
+
+    def __init__(self, client, ships, components_per_ship):
+        status, page = client.json('GET', f'/api/ships?per_page={ships}')
+        self.ship_ids = [ship['id'] for ship in page['ships']] if page else []
+        self.component_ids = []
+        for ship_id in self.ship_ids:
+            status, page = client.json('GET', f'/api/ships/{ship_id}/components?per_page={components_per_ship}')
+            if page:
+                self.component_ids.extend(component['id'] for component in page['components'])
+        if not self.ship_ids or not self.component_ids:
+            raise SystemExit("Нет данных для теста: запустите benchmarks/generate_fleet.py")
+
+
+def scenario_list(rng, pools, state):
+    # Половина запросов продолжает листание с курсора предыдущей страницы
+    cursor = state.get('ships_cursor') if rng.random() < 0.5 else None
+    path = '/api/ships?per_page=20' + (f'&after={cursor}' if cursor else '')
+    status, data = yield 'GET /api/ships', 'GET', path, None
+    state['ships_cursor'] = (data or {}).get('next_cursor')
+    yield 'GET /api/ships/<id>/components', 'GET', f'/api/ships/{rng.choice(pools.ship_ids)}/components?per_page=20', None
+
+
+def scenario_detail(rng, pools, state):
+    component_id = rng.choice(pools.component_ids)
+    yield 'GET /api/ships/<id>', 'GET', f'/api/ships/{rng.choice(pools.ship_ids)}', None
+    yield 'GET /api/components/<id>', 'GET', f'/api/components/{component_id}', None
+    yield 'GET /api/components/<id>/updates', 'GET', f'/api/components/{component_id}/updates?per_page=5', None
+
+
+def scenario_expiring(rng, pools, state):
+    yield 'GET /api/expiring_components', 'GET', '/api/expiring_components?per_page=20', None
+
+
+def scenario_status_update(rng, pools, state):
+    body = {'update_name': 'Нагрузочный тест', 'new_status': rng.choice(STATUS_CHOICES), 'notes': ''}
+    yield ('POST /api/components/<id>/update_status', 'POST',
+           f'/api/components/{rng.choice(pools.component_ids)}/update_status', body)
+
+
+def scenario_login(rng, pools, state):
+    yield 'POST /api/login', 'POST', '/api/login', state['credentials']
+
+
+SCENARIO_STEPS = {
+    'list': scenario_list,
+    'detail': scenario_detail,
+    'expiring': scenario_expiring,
+    'status_update': scenario_status_update,
+    'login': scenario_login,
+}
+
+
+def login(client, credentials):
+    status, _ = client.request('POST', '/api/login', credentials)
+    if status != 200:
+        raise SystemExit(f"Не удалось войти как {credentials['username']}: {status}")
+
+
+def worker(args, scenario, index, pools, stop, results, lock):
+    rng = random.Random(args.seed * 1000 + index)
+    credentials = {'username': f"{args.user_prefix}{index % args.users + 1}", 'password': args.password}
+    client = Client(args.url, args.accept_encoding)
+    if scenario != 'login':
+        login(client, credentials)
+    state = {'credentials': credentials}
+    latencies, statuses = defaultdict(list), defaultdict(Counter)
+    while not stop.is_set():
+        steps = SCENARIO_STEPS[scenario](rng, pools, state)
+        response = None
+        try:
+            while True:
+                name, method, path, body = steps.send(response)
+                if scenario == 'login':
+                    client.cookies.clear()
+                started = time.perf_counter()
+                status, data = client.request(method, path, body)
+                elapsed = (time.perf_counter() - started) * 1000
+                statuses[name][status] += 1
+                if status is not None and (200 <= status < 300 or status == 304):
+                    latencies[name].append(elapsed)
+                response = (status, json.loads(data) if status == 200 and data else None)
+                if client.retry_after:
+                    # Как и настоящий клиент, выдерживаем паузу из Retry-After при 503
+                    stop.wait(float(client.retry_after))
+        except StopIteration:
+            pass
+    with lock:
+        for name, values in latencies.items():
+            results[name]['latencies'].extend(values)
+        for name, counter in statuses.items():
+            results[name]['statuses'].update(counter)
+
+
+def run_scenario(args, scenario, pools):
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = defaultdict(lambda: {'latencies': [], 'statuses': Counter()})
+    threads = [threading.Thread(target=worker, args=(args, scenario, index, pools, stop, results, lock))
+               for index in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    report = {}
+    for name, result in results.items():
+        latencies = result['latencies']
+        report[name] = {
+            'scenario': scenario,
+            'requests': sum(result['statuses'].values()),
+            'ok': len(latencies),
+            'rps': round(len(latencies) / args.duration, 1),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': round(max(latencies), 1) if latencies else None,
+            'statuses': {str(status): count for status, count in sorted(result['statuses'].items(), key=str)},
+        }
+    return report
+
+
+def change_pct(new, old):
+    if new is None or not old:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def compare(endpoints, baseline):
+    comparison = {}
+    for name, result in endpoints.items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if previous:
+            comparison[name] = {
+                'p95_ms_change_pct': change_pct(result['p95_ms'], previous['p95_ms']),
+                'p99_ms_change_pct': change_pct(result['p99_ms'], previous['p99_ms']),
+                'rps_change_pct': change_pct(result['rps'], previous['rps']),
+            }
+    return {'baseline_commit': baseline.get('meta', {}).get('commit'), 'endpoints': comparison}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5252')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='через запятую: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--users', type=int, default=20, help='сколько пользователей generate_fleet.py использовать')
+    parser.add_argument('--user-prefix', default='bench_user_')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--pool-ships', type=int, default=100, help='судов в наборе идентификаторов')
+    parser.add_argument('--pool-components-per-ship', type=int, default=50)
+    parser.add_argument('--accept-encoding', default=None, help='например "br, gzip", по умолчанию без сжатия')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='записать JSON в файл вместо stdout')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    setup_client = Client(args.url)
+    login(setup_client, {'username': f"{args.user_prefix}1", 'password': args.password})
+    pools = Pools(setup_client, args.pool_ships, args.pool_components_per_ship)
+
+    endpoints = {}
+    for scenario in scenarios:
+        endpoints.update(run_scenario(args, scenario, pools))
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'url': args.url,
+            'clients': args.clients,
+            'duration_s': args.duration,
+            'scenarios': scenarios,
+        },
+        'endpoints': endpoints,
+    }
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            result['comparison'] = compare(endpoints, json.load(f))
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
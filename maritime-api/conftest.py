@@ -0,0 +1,63 @@
+import os
+import uuid
+
+import pytest
+
+# Тесты с БД запускаются только на отдельной базе, созданной из db_tmp/init/init.sql:
+# TEST_DATABASE_URL подменяет DATABASE_URL до импорта api
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+# Без токена /api/metrics отключен
+os.environ.setdefault('METRICS_TOKEN', 'test-metrics-token')
+
+from api import app, db
+from sqlalchemy import text
+
+
+@pytest.fixture
+def auth_client():
+    """Тестовый клиент с cookie JWT администратора (id 1 из init.sql) и заголовком CSRF для изменяющих запросов."""
+    from flask_jwt_extended import create_access_token, get_csrf_token
+    with app.app_context():
+        token = create_access_token(identity="1")
+        csrf_token = get_csrf_token(token)
+    with app.test_client() as client:
+        client.set_cookie('access_token_cookie', token)
+        client.environ_base['HTTP_X_CSRF_TOKEN'] = csrf_token
+        yield client
+
+
+@pytest.fixture
+def test_db():
+    """Контекст приложения на тестовой базе; без TEST_DATABASE_URL тест пропускается."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    with app.app_context():
+        yield db
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture
+def ship(test_db):
+    """Судно с тремя компонентами типа 1; удаляется вместе с компонентами и журналами после теста."""
+    suffix = uuid.uuid4().hex[:8]
+    ship_id = test_db.session.execute(text(
+        "INSERT INTO ships (name, imo_number, type, owner_company) VALUES (:name, :imo, 'Танкер', 'Тест') RETURNING id"
+    ), {'name': f"Тест {suffix}", 'imo': f"TEST{suffix}"}).scalar()
+    component_ids = test_db.session.execute(text("""
+        INSERT INTO components (name, ship_id, component_type_id, serial_number, service_life_months,
+                                last_inspection_date, status)
+        SELECT 'Компонент ' || n, :ship_id, 1, :prefix || n, 12, CURRENT_DATE, 'Рабочий'
+        FROM generate_series(1, 3) AS n
+        RETURNING id
+    """), {'ship_id': ship_id, 'prefix': f"SN-{suffix}-"}).scalars().all()
+    test_db.session.commit()
+    yield {'id': ship_id, 'suffix': suffix, 'component_ids': sorted(component_ids)}
+    test_db.session.rollback()
+    # Удалять можно только списанные компоненты (block_component_deletion)
+    test_db.session.execute(text("UPDATE components SET status = 'Списан' WHERE ship_id = :ship_id"), {'ship_id': ship_id})
+    test_db.session.execute(text("DELETE FROM ships WHERE id = :ship_id"), {'ship_id': ship_id})
+    test_db.session.execute(text("DELETE FROM component_audit WHERE component_id = ANY(:ids)"), {'ids': component_ids})
+    test_db.session.commit()
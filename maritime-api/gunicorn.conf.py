@@ -0,0 +1,113 @@
+"""Настройки gunicorn для production-запуска API: gunicorn -c gunicorn.conf.py api:app
+
+Все параметры задаются переменными окружения:
+    WEB_CONCURRENCY            число процессов (по умолчанию по числу CPU, но не больше бюджета соединений)
+    DB_CONNECTION_BUDGET       сколько соединений с Postgres может открыть API всеми процессами (80)
+    GUNICORN_WORKER_CLASS      gthread (по умолчанию) или gevent
+    GUNICORN_THREADS           потоков на процесс для gthread (4)
+    GUNICORN_WORKER_CONNECTIONS одновременных соединений на процесс для gevent (100)
+    GUNICORN_KEEPALIVE         keep-alive в секундах (5)
+    GUNICORN_TIMEOUT           таймаут зависшего процесса (30)
+    GUNICORN_GRACEFUL_TIMEOUT  время на завершение запросов при reload/остановке (30)
+    GUNICORN_MAX_REQUESTS      перезапуск процесса после N запросов, 0 - выключено (1000)
+    GUNICORN_PRELOAD           загрузить приложение до fork (true)
+    PROMETHEUS_MULTIPROC_DIR   каталог для сбора метрик /api/metrics со всех процессов
+
+Плавная перезагрузка: kill -HUP <pid мастера>.
+При нескольких процессах лучше писать логи только в stdout (LOG_FILE=""), так как
+RotatingFileHandler не согласует ротацию одного файла между процессами.
+Пул соединений с БД настраивается в api.py (DB_POOL_SIZE, DB_MAX_OVERFLOW, ...);
+DB_POOL_SIZE стоит держать не меньше GUNICORN_THREADS, а PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE - меньше;
+по умолчанию api.py делит ядра между WEB_CONCURRENCY процессами и сам укладывается в GUNICORN_THREADS.
+Лимиты групп эндпоинтов (ADMISSION_<GROUP>_LIMIT, ADMISSION_<GROUP>_QUEUE) действуют внутри процесса:
+сумма лимитов и очередей групп auth и heavy должна быть меньше GUNICORN_THREADS, чтобы легкие
+запросы (/api/me, списки) всегда находили свободный поток.
+
+Замеры benchmarks/load_test.py --scenarios list,detail,status_update --clients 16 --duration 10
+на флоте generate_fleet.py (5000 судов, 2 млн компонентов), 1 vCPU, Postgres и генератор нагрузки на той же машине;
+req/s и p50/p99 в мс:
+                                  GET /api/ships      GET /api/components/<id>/updates  POST .../update_status
+    python api.py (Werkzeug)      69, 19 / 36         35, 31 / 48                       76, 37 / 53
+    gthread 1 процесс x 4 потока  61, 20 / 50         32, 31 / 83                       89, 30 / 47
+    gthread 1 процесс x 8 потоков 61, 20 / 36         31, 33 / 69                       88, 30 / 48
+    gthread 2 процесса x 4 потока 56, 38 / 66         27, 71 / 118                      73, 35 / 69
+    gthread 3 процесса x 4 потока 50, 57 / 117        28, 80 / 230                      71, 82 / 157
+Чтения здесь упираются в единственное ядро, которое делят API, Postgres и генератор, и от сервера почти
+не зависят; запись выигрывает у dev-сервера ~17% пропускной способности. Процессы сверх числа ядер
+только добавляют переключения и удваивают p99, поэтому по умолчанию WEB_CONCURRENCY равен числу CPU,
+а ожидание БД перекрывают потоки. Переход на gunicorn оправдан прежде всего эксплуатацией:
+таймауты зависших процессов, плавная перезагрузка, перезапуск по GUNICORN_MAX_REQUESTS.
+"""
+import glob
+import multiprocessing
+import os
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5252')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Бюджет соединений: каждый процесс держит свой пул SQLAlchemy до DB_POOL_SIZE + DB_MAX_OVERFLOW соединений.
+# 80 по умолчанию - это max_connections = 100 в Postgres за вычетом superuser_reserved_connections (3),
+# бота (BOT_DB_POOL_SIZE = 3 и соединение LISTEN) и запаса на pgAdmin, миграции и psql
+db_connection_budget = int(os.environ.get('DB_CONNECTION_BUDGET', 80))
+db_pool_size = int(os.environ.get('DB_POOL_SIZE', 5))
+db_max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+if 'WEB_CONCURRENCY' in os.environ:
+    workers = int(os.environ['WEB_CONCURRENCY'])
+else:
+    workers = max(1, min(multiprocessing.cpu_count(), db_connection_budget // (db_pool_size + db_max_overflow)))
+if workers * db_pool_size > db_connection_budget:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} x DB_POOL_SIZE={db_pool_size} превышает DB_CONNECTION_BUDGET={db_connection_budget}"
+    )
+# Явно заданное число процессов укладывается в бюджет за счет переполнения пула
+db_max_overflow = min(db_max_overflow, db_connection_budget // workers - db_pool_size)
+# api.py подбирает по ним размеры пулов, поэтому вычисленные значения передаются ему
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+os.environ['DB_MAX_OVERFLOW'] = str(db_max_overflow)
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+preload_app = _env_bool('GUNICORN_PRELOAD', True)
+accesslog = None
+errorlog = '-'
+
+# Каталог метрик prometheus должен существовать и быть пустым до загрузки приложения (preload)
+prometheus_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if prometheus_dir:
+    os.makedirs(prometheus_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(prometheus_dir, '*.db')):
+        os.remove(stale)
+
+
+def child_exit(server, worker):
+    if prometheus_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen не установлен: запросы к БД будут блокировать gevent-воркер")
+
+    # Соединения, открытые мастером при preload, нельзя разделять между процессами
+    from api import app, db, setup_logging, password_hasher, start_background_jobs
+    with app.app_context():
+        db.engine.dispose(close=False)
+    # Поток записи логов не переживает fork, каждому процессу нужен свой
+    setup_logging()
+    password_hasher.start()
+    start_background_jobs()
@@ -1,4 +1,28 @@
-from api import app
+import gzip
+import io
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+import pytest
+from flask import jsonify
+from flask_jwt_extended import create_access_token
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import generate_password_hash
+
+from api import (
+    app, encode_cursor, decode_cursor, iter_import_rows, parse_component_payload, parse_status_update,
+    ReferenceCache, JsonLogFormatter, DroppingQueueHandler, PasswordHasher, PasswordHasherBusy,
+    ConcurrencyLimiter, admission_limiters, gzip_chunks, compress_response, METRICS_TOKEN,
+)
+
+METRICS_HEADERS = {'Authorization': f"Bearer {METRICS_TOKEN}"}
+
 
 def test_health_check():
     """Тест проверяет, что эндпоинт /api/health отвечает статусом 200 OK."""
@@ -7,3 +31,503 @@ def test_health_check():
         assert response.status_code == 200
         assert response.json == {"status": "ok"}
 
+
+def test_cursor_roundtrip():
+    """Тест проверяет, что курсор пагинации восстанавливает исходные значения ключа."""
+    token = encode_cursor(date(2024, 5, 1), 42)
+    with app.test_request_context():
+        assert decode_cursor(token, [date.fromisoformat, int]) == (date(2024, 5, 1), 42)
+
+def test_invalid_cursor_rejected(auth_client):
+    """Тест проверяет, что поврежденный курсор отклоняется с кодом 400 до обращения к БД."""
+    response = auth_client.get('/api/expiring_components?after=not-a-cursor')
+    assert response.status_code == 400
+    assert response.json["success"] is False
+
+def test_import_rows_validation():
+    """Тест проверяет построчную валидацию CSV при массовом импорте компонентов."""
+    csv_body = (
+        "name,component_type_id,service_life_months,last_inspection_date,serial_number\n"
+        "Главный двигатель,1,36,2024-01-15,ENG-001\n"
+        "Радар,99,24,2024-03-20,\n"
+        "GPS,2,0,2024-03-20,NAV-003\n"
+    ).encode('utf-8')
+    results = [
+        (row_number, parse_component_payload(data, {1, 2}.__contains__))
+        for row_number, data in iter_import_rows('csv', io.BytesIO(csv_body))
+    ]
+    assert [row_number for row_number, _ in results] == [1, 2, 3]
+    fields, error = results[0][1]
+    assert error is None and fields['serial_number'] == 'ENG-001' and fields['status'] == 'Рабочий'
+    assert results[1][1][0] is None and 'component_type' in results[1][1][1]
+    assert results[2][1][0] is None
+
+def test_parse_status_update():
+    """Тест проверяет валидацию элементов пакетного обновления статуса."""
+    fields, error = parse_status_update({'component_id': '7', 'update_name': 'Осмотр', 'new_status': 'Неисправен', 'service_life_months': 48})
+    assert error is None and fields['component_id'] == 7 and fields['service_life_months'] == 48
+    assert parse_status_update({'component_id': 7, 'update_name': 'Осмотр', 'new_status': 'Сломан'})[0] is None
+    assert parse_status_update({'component_id': 7, 'new_status': 'Рабочий'})[0] is None
+    assert parse_status_update({'component_id': 7, 'update_name': 'Осмотр', 'new_status': 'Рабочий', 'service_life_months': 900})[0] is None
+
+def test_reference_cache_hits_and_invalidation():
+    """Тест проверяет явный сброс кэша справочников и счетчики попаданий в /api/metrics."""
+    def cache_samples():
+        with app.test_client() as client:
+            body = client.get('/api/metrics', headers=METRICS_HEADERS).get_data(as_text=True)
+        return {name: float(line.split()[-1]) for line in body.splitlines()
+                for name in ('hits', 'misses')
+                if line.startswith(f'maritime_reference_cache_{name}_total{{cache="test_types"}}')}
+
+    before = cache_samples()
+    cache = ReferenceCache(ttl=60, version_check_interval=60)
+    cache._versions_checked_at = time.monotonic()
+    loads = []
+    loader = lambda: loads.append(1) or {'items': []}
+    cache.get('test_types', 'all', loader)
+    cache.get('test_types', 'all', loader)
+    assert len(loads) == 1
+    cache.invalidate('test_types')
+    cache._versions_checked_at = time.monotonic()
+    cache.get('test_types', 'all', loader)
+    assert len(loads) == 2
+    after = cache_samples()
+    assert after['hits'] - before.get('hits', 0) == 1 and after['misses'] - before.get('misses', 0) == 2
+
+def test_request_id_and_json_log_format():
+    """Тест проверяет X-Request-ID в ответе и поля структурированного JSON-лога."""
+    with app.test_client() as client:
+        response = client.get('/api/health', headers={'X-Request-ID': 'req-42'})
+        assert response.headers['X-Request-ID'] == 'req-42'
+    record = logging.LogRecord('api', logging.INFO, __file__, 1, '%s done', ('GET',), None)
+    record.ip, record.request_id, record.http = '10.0.0.1', 'req-42', {'status': 200, 'duration_ms': 1.5}
+    entry = json.loads(JsonLogFormatter().format(record))
+    assert entry['message'] == 'GET done' and entry['request_id'] == 'req-42' and entry['status'] == 200
+
+def test_metrics_endpoint():
+    """Тест проверяет, что /api/metrics требует токен и отдает гистограмму задержек в формате Prometheus."""
+    with app.test_client() as client:
+        client.get('/api/health')
+        assert client.get('/api/metrics').status_code == 403
+        assert client.get('/api/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+        response = client.get('/api/metrics', headers=METRICS_HEADERS)
+        assert response.status_code == 200
+        body = response.get_data(as_text=True)
+        assert 'maritime_http_request_duration_seconds_bucket' in body
+        assert 'endpoint="/api/health"' in body
+
+def test_dropped_log_records_exported():
+    """Тест проверяет, что записи, не поместившиеся в очередь лога, видны в /api/metrics."""
+    handler = DroppingQueueHandler(queue.Queue(1))
+    for _ in range(3):
+        handler.emit(logging.LogRecord('test', logging.INFO, __file__, 0, 'message', None, None))
+    assert handler.dropped == 2
+    with app.test_client() as client:
+        body = client.get('/api/metrics', headers=METRICS_HEADERS).get_data(as_text=True)
+    dropped = [line for line in body.splitlines() if line.startswith('maritime_log_records_dropped_total ')]
+    assert dropped and float(dropped[0].split()[1]) >= 2
+
+def test_password_hasher_pool_and_rehash():
+    """Тест проверяет хэширование в пуле процессов, отказ при переполнении и признак пересчета хэша."""
+    hasher = PasswordHasher(workers=1, queue_size=0, method='pbkdf2:sha256:1000', timeout=30)
+    pwhash = hasher.hash('secret')
+    assert hasher.verify(pwhash, 'secret') and not hasher.verify(pwhash, 'wrong')
+    assert not hasher.needs_rehash(pwhash)
+    assert PasswordHasher(0, 0, 'pbkdf2:sha256:2000', 30).needs_rehash(pwhash)
+    hasher._slots.acquire()
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash('secret')
+    # С queue_timeout запрос дожидается освободившегося места вместо немедленного отказа
+    hasher.queue_timeout = 5
+    threading.Timer(0.1, hasher._slots.release).start()
+    assert hasher.verify(pwhash, 'secret')
+
+def test_admission_control_sheds_with_retry_after(auth_client):
+    """Тест проверяет отказ сверх лимита группы: 503, Retry-After и счетчик отклоненных запросов.
+
+    Запрос без токена получает 401, не занимая место в группе.
+    """
+    limiter = ConcurrencyLimiter(limit=1, queue_size=1, queue_timeout=0.01)
+    assert limiter.try_acquire() is None
+    assert limiter.try_acquire() == 'queue_timeout'
+    limiter.queue_size = 0
+    assert limiter.try_acquire() == 'queue_full'
+    admission_limiters['default'] = limiter
+    try:
+        response = auth_client.get('/api/me')
+        assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+        assert auth_client.get('/api/health').status_code == 200
+        with app.test_client() as client:
+            assert client.get('/api/me').status_code == 401
+        body = auth_client.get('/api/metrics', headers=METRICS_HEADERS).get_data(as_text=True)
+        assert 'maritime_requests_shed_total{group="default",reason="queue_full"} 1.0' in body
+    finally:
+        del admission_limiters['default']
+
+def test_export_gzip_stream_and_validation(auth_client):
+    """Тест проверяет сжатие потока экспорта и отказ для неизвестного набора данных или формата."""
+    assert gzip.decompress(b''.join(gzip_chunks(['{"id": 1}\n', '', '{"id": 2}\n']))) == b'{"id": 1}\n{"id": 2}\n'
+    assert auth_client.get('/api/export/passwords').status_code == 404
+    assert auth_client.get('/api/export/ships?format=xml').status_code == 400
+
+def test_json_dates_and_compression():
+    """Тест проверяет ISO-даты в JSON-ответе и сжатие gzip крупного ответа со слабым ETag."""
+    with app.app_context():
+        assert jsonify({'d': date(2025, 3, 1)}).get_json() == {'d': '2025-03-01'}
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        response = jsonify({'items': ['x' * 100] * 50})
+        response.set_etag('abc')
+        response = compress_response(response)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.get_etag() == ('abc', True)
+        assert gzip.decompress(response.get_data()).startswith(b'{"items"')
+
+def test_search_validation(auth_client):
+    """Тест проверяет проверку параметров поиска до обращения к БД."""
+    assert auth_client.get('/api/search?q=ab&match=fuzzy').status_code == 400
+    assert auth_client.get('/api/search?q=ab&type=users').status_code == 400
+    assert auth_client.get('/api/search?q=ab&match=regex').status_code == 400
+    assert auth_client.get('/api/search?q=').status_code == 400
+    assert auth_client.get('/api/search?q=ab&after=broken').status_code == 400
+
+
+def test_analytics_validation(auth_client):
+    """Тест проверяет проверку параметров аналитики до обращения к БД."""
+    assert auth_client.get('/api/analytics/top_issues?year=2024').status_code == 400
+    assert auth_client.get('/api/analytics/top_issues?year=2024&quarter=5').status_code == 400
+    assert auth_client.get('/api/analytics/updates_count?start=2024-01-01').status_code == 400
+    assert auth_client.get('/api/analytics/updates_count?start=2024-13-01&end=2024-12-31').status_code == 400
+    assert auth_client.get('/api/analytics/issues_by_quarter?from=yesterday').status_code == 400
+
+
+def test_avg_repair_time_for_other_user_requires_admin(auth_client, test_db):
+    """Тест проверяет, что среднее время ремонта другого пользователя доступно только администратору."""
+    with app.app_context():
+        engineer_token = create_access_token(identity="2")
+    with app.test_client() as engineer:
+        engineer.set_cookie('access_token_cookie', engineer_token)
+        assert engineer.get('/api/analytics/avg_repair_time').json['user_id'] == 2
+        assert engineer.get('/api/analytics/avg_repair_time?user_id=2').status_code == 200
+        assert engineer.get('/api/analytics/avg_repair_time?user_id=3').status_code == 403
+    response = auth_client.get('/api/analytics/avg_repair_time?user_id=2')
+    assert response.status_code == 200 and response.json['user_id'] == 2
+
+
+def test_expiration_date_maintained(auth_client, ship, test_db):
+    """Тест проверяет пересчет expiration_date триггером и выдачу компонента в /api/expiring_components."""
+    component_id = ship['component_ids'][0]
+    test_db.session.execute(text("UPDATE components SET service_life_months = 1 WHERE id = :id"), {'id': component_id})
+    test_db.session.commit()
+    expiration_date, expected = test_db.session.execute(text("""
+        SELECT expiration_date, (last_inspection_date + INTERVAL '1 month')::date
+        FROM components WHERE id = :id
+    """), {'id': component_id}).one()
+    assert expiration_date == expected
+
+    found, after = None, None
+    while found is None:
+        params = {'pagination': 'cursor', 'per_page': 100, 'status': 'Рабочий', **({'after': after} if after else {})}
+        page = auth_client.get('/api/expiring_components', query_string=params).json
+        found = next((c for c in page['expiring_components'] if c['id'] == component_id), None)
+        after = page['next_cursor']
+        if found is None:
+            assert after, "компонент со сроком через месяц не попал в выдачу"
+    assert found['expiration_date'] == expiration_date.isoformat()
+    assert found['days_remaining'] == (expiration_date - test_db.session.execute(text("SELECT CURRENT_DATE")).scalar()).days
+
+
+def test_fuzzy_search_pages_through_equal_scores(auth_client, ship, test_db):
+    """Тест проверяет, что курсор нечеткого поиска не теряет и не повторяет записи с одинаковым расстоянием."""
+    # Латиница: при LC_CTYPE=C pg_trgm не строит триграммы из кириллицы
+    test_db.session.execute(text("""
+        UPDATE components SET name = 'Ballast pump ' || (id % 3 + 1) WHERE ship_id = :ship_id
+    """), {'ship_id': ship['id']})
+    test_db.session.commit()
+    seen, after = [], None
+    while True:
+        params = {'q': 'Ballast pump', 'match': 'fuzzy', 'type': 'components', 'per_page': 1, **({'after': after} if after else {})}
+        page = auth_client.get('/api/search', query_string=params).json
+        seen += [(row['id'], row['score']) for row in page['results'] if row['ship_id'] == ship['id']]
+        after = page['next_cursor']
+        if not after:
+            break
+    assert sorted(component_id for component_id, _ in seen) == ship['component_ids']
+    assert len({score for _, score in seen}) == 1
+
+
+def test_login_survives_failed_rehash(test_db, monkeypatch):
+    """Тест проверяет, что ошибка сохранения пересчитанного хэша не мешает входу."""
+    username = f"rehash_{uuid.uuid4().hex[:8]}"
+    test_db.session.execute(text(
+        "INSERT INTO users (username, password_hash, role_id) VALUES (:username, :pwhash, 3)"
+    ), {'username': username, 'pwhash': generate_password_hash('secret', 'pbkdf2:sha256:1000')})
+    test_db.session.commit()
+    try:
+        def failing_commit():
+            raise OperationalError("UPDATE users", {}, Exception("connection lost"))
+        monkeypatch.setattr(test_db.session, 'commit', failing_commit)
+        with app.test_client() as client:
+            response = client.post('/api/login', json={'username': username, 'password': 'secret'})
+        assert response.status_code == 200
+        assert any(cookie.startswith('access_token_cookie=') for cookie in response.headers.getlist('Set-Cookie'))
+    finally:
+        monkeypatch.undo()
+        stored = test_db.session.execute(text("SELECT password_hash FROM users WHERE username = :username"),
+                                         {'username': username}).scalar()
+        test_db.session.execute(text("DELETE FROM users WHERE username = :username"), {'username': username})
+        test_db.session.commit()
+    assert stored.startswith('pbkdf2:sha256:1000$')
+
+
+def test_users_cache_version_ignores_password_rehash(test_db):
+    """Тест проверяет, что версия кэша users не меняется при записи одного password_hash."""
+    def users_version():
+        return test_db.session.execute(text("SELECT version FROM cache_versions WHERE name = 'users'")).scalar()
+    telegram_id, version = test_db.session.execute(text("SELECT telegram_id FROM users WHERE id = 1")).scalar(), users_version()
+    test_db.session.execute(text("UPDATE users SET password_hash = password_hash WHERE id = 1"))
+    test_db.session.commit()
+    assert users_version() == version
+    test_db.session.execute(text("UPDATE users SET telegram_id = :telegram_id WHERE id = 1"), {'telegram_id': telegram_id})
+    test_db.session.commit()
+    assert users_version() == version + 1
+
+
+def test_conditional_get_component(auth_client, ship):
+    """Тест проверяет 304 по If-None-Match и новый ETag после изменения компонента."""
+    component_id = ship['component_ids'][0]
+    first = auth_client.get(f'/api/components/{component_id}')
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'private, no-cache'
+    etag = first.headers['ETag']
+    assert auth_client.get(f'/api/components/{component_id}', headers={'If-None-Match': etag}).status_code == 304
+    # ETag учитывает параметры запроса: другой набор include - другое представление
+    assert auth_client.get(f'/api/components/{component_id}?include=ship',
+                           headers={'If-None-Match': etag}).status_code == 200
+
+    response = auth_client.post(f'/api/components/{component_id}/update_status',
+                                json={'update_name': 'Осмотр', 'new_status': 'Требует проверки'})
+    assert response.status_code == 200
+    changed = auth_client.get(f'/api/components/{component_id}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert changed.json['status'] == 'Требует проверки'
+
+
+def test_conditional_get_ship_if_modified_since(auth_client, ship, test_db):
+    """Тест проверяет 304 по If-Modified-Since для судна и 200 после его изменения."""
+    first = auth_client.get(f"/api/ships/{ship['id']}")
+    assert first.status_code == 200
+    last_modified = first.headers['Last-Modified']
+    assert auth_client.get(f"/api/ships/{ship['id']}", headers={'If-Modified-Since': last_modified}).status_code == 304
+    # If-Modified-Since точен до секунды, а updated_at ставит триггер touch_updated_at
+    time.sleep(1)
+    test_db.session.execute(text("UPDATE ships SET owner_company = 'Тест 2' WHERE id = :id"), {'id': ship['id']})
+    test_db.session.commit()
+    assert auth_client.get(f"/api/ships/{ship['id']}", headers={'If-Modified-Since': last_modified}).status_code == 200
+
+
+def test_conditional_get_lists_follow_trigger_versions(auth_client, ship, test_db):
+    """Тест проверяет, что ETag списка судов и истории компонента меняют триггеры версий."""
+    component_id = ship['component_ids'][0]
+    ships_etag = auth_client.get('/api/ships').headers['ETag']
+    updates_etag = auth_client.get(f'/api/components/{component_id}/updates').headers['ETag']
+    assert auth_client.get('/api/ships', headers={'If-None-Match': ships_etag}).status_code == 304
+    assert auth_client.get(f'/api/components/{component_id}/updates',
+                           headers={'If-None-Match': updates_etag}).status_code == 304
+
+    # Запись истории без смены статуса тоже меняет ETag истории
+    test_db.session.execute(text("""
+        INSERT INTO component_updates (component_id, user_id, update_name, update_date, new_status, notes)
+        VALUES (:component_id, 2, 'Осмотр', CURRENT_DATE, 'Рабочий', '')
+    """), {'component_id': component_id})
+    test_db.session.execute(text("UPDATE ships SET owner_company = 'Тест 2' WHERE id = :id"), {'id': ship['id']})
+    test_db.session.commit()
+    assert auth_client.get('/api/ships', headers={'If-None-Match': ships_etag}).status_code == 200
+    changed = auth_client.get(f'/api/components/{component_id}/updates', headers={'If-None-Match': updates_etag})
+    assert changed.status_code == 200 and [u['update_name'] for u in changed.json['updates']] == ['Осмотр']
+
+
+def test_batch_fetch_with_latest_updates(auth_client, ship, test_db):
+    """Тест проверяет выборку ?ids= в порядке запроса с missing_ids и include=latest_updates."""
+    first, second = ship['component_ids'][:2]
+    test_db.session.execute(text("""
+        INSERT INTO component_updates (component_id, user_id, update_name, update_date, new_status, notes)
+        SELECT :component_id, 2, 'Осмотр ' || n, CURRENT_DATE - n, 'Рабочий', ''
+        FROM generate_series(0, 6) AS n
+    """), {'component_id': first})
+    test_db.session.commit()
+
+    response = auth_client.get('/api/components', query_string={
+        'ids': f"{second},2147483647,{first},{second}", 'include': 'latest_updates,ship'})
+    assert response.status_code == 200
+    body = response.json
+    assert [c['id'] for c in body['components']] == [second, first]
+    assert body['missing_ids'] == [2147483647]
+    by_id = {c['id']: c for c in body['components']}
+    assert by_id[first]['ship']['id'] == ship['id'] and 'component_type' not in by_id[first]
+    assert [u['update_name'] for u in by_id[first]['latest_updates']] == [f"Осмотр {n}" for n in range(5)]
+    assert by_id[second]['latest_updates'] == []
+
+    ships = auth_client.get('/api/ships', query_string={'ids': f"2147483647,{ship['id']}"}).json
+    assert [s['id'] for s in ships['ships']] == [ship['id']] and ships['missing_ids'] == [2147483647]
+    assert auth_client.get('/api/components', query_string={'ids': first, 'include': 'owner'}).status_code == 400
+
+
+def test_import_copies_in_batches_and_limits_body(auth_client, ship, test_db, monkeypatch):
+    """Тест проверяет импорт CSV несколькими пачками COPY и отказ 413 для тела больше MAX_CONTENT_LENGTH."""
+    monkeypatch.setattr('api.IMPORT_COPY_BATCH_ROWS', 2)
+    csv_body = "name,component_type_id,service_life_months,last_inspection_date\n" + "".join(
+        f"Импорт {n},1,{0 if n == 3 else 12},2024-01-15\n" for n in range(1, 7)
+    )
+    url = f"/api/ships/{ship['id']}/components/import"
+    response = auth_client.post(url, data=csv_body.encode('utf-8'), content_type='text/csv')
+    assert response.status_code == 201
+    assert response.json['imported'] == 5 and [e['row'] for e in response.json['errors']] == [3]
+    names = test_db.session.execute(text("""
+        SELECT name FROM components WHERE ship_id = :ship_id AND name LIKE 'Импорт %' ORDER BY id
+    """), {'ship_id': ship['id']}).scalars().all()
+    assert names == [f"Импорт {n}" for n in (1, 2, 4, 5, 6)]
+
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 64)
+    response = auth_client.post(url, data=csv_body.encode('utf-8'), content_type='text/csv')
+    assert response.status_code == 413 and response.json['error'] == 'Размер запроса превышает допустимый.'
+
+
+def test_ship_deletion_decommissions_components(auth_client, ship, test_db):
+    """Тест проверяет списание компонентов одним оператором и удаление судна, синхронно и заданием."""
+    first = ship['component_ids'][0]
+    test_db.session.execute(text("UPDATE components SET status = 'Списан' WHERE id = :id"), {'id': first})
+    test_db.session.commit()
+
+    response = auth_client.delete(f"/api/ships/{ship['id']}?async=1")
+    assert response.status_code == 202
+    status_url = response.json['status_url']
+    for _ in range(100):
+        job = auth_client.get(status_url).json['job']
+        if job['status'] not in ('pending', 'running'):
+            break
+        time.sleep(0.1)
+    assert job['status'] == 'done' and job['attempts'] == 1
+    # Уже списанный компонент повторно не списывается
+    assert job['components_decommissioned'] == 2
+    assert test_db.session.execute(text("SELECT count(*) FROM ships WHERE id = :id"), {'id': ship['id']}).scalar() == 0
+    decommissioned = test_db.session.execute(text("""
+        SELECT component_id, user_id FROM component_audit
+        WHERE component_id = ANY(:ids) AND operation_type = 'UPDATE' AND new_status = 'Списан' AND user_id IS NOT NULL
+        ORDER BY component_id
+    """), {'ids': ship['component_ids']}).all()
+    assert decommissioned == [(component_id, 1) for component_id in ship['component_ids'][1:]]
+    assert auth_client.delete(f"/api/ships/{ship['id']}").status_code == 404
+    test_db.session.execute(text("DELETE FROM ship_deletion_jobs WHERE id = :id"), {'id': job['id']})
+    test_db.session.commit()
+
+
+def test_ship_deletion_without_current_history_partition(auth_client, ship, test_db, monkeypatch):
+    """Тест проверяет удаление судна, когда секции component_updates текущего месяца еще нет."""
+    month_start = date.today().replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1)
+    partition = f"component_updates_p{month_start:%Y_%m}"
+    test_db.session.execute(text(f"ALTER TABLE component_updates DETACH PARTITION {partition}"))
+    test_db.session.execute(text(f"ALTER TABLE {partition} RENAME TO saved_{partition}"))
+    test_db.session.commit()
+    # Процесс уже проверял секции в этом месяце и без сброса не обратился бы к БД
+    monkeypatch.setattr('api.history_partitions_month', None)
+    try:
+        response = auth_client.delete(f"/api/ships/{ship['id']}")
+        assert response.status_code == 200
+        assert test_db.session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': partition}).scalar()
+        assert test_db.session.execute(text("""
+            SELECT count(*) FROM component_audit
+            WHERE component_id = ANY(:ids) AND operation_type = 'UPDATE' AND new_status = 'Списан'
+        """), {'ids': ship['component_ids']}).scalar() == 3
+    finally:
+        # Записи созданной секции удалены каскадом вместе с компонентами, поэтому ее можно заменить сохраненной
+        test_db.session.rollback()
+        test_db.session.execute(text(f"DROP TABLE IF EXISTS {partition}"))
+        test_db.session.execute(text(f"ALTER TABLE saved_{partition} RENAME TO {partition}"))
+        test_db.session.execute(text(
+            f"ALTER TABLE component_updates ATTACH PARTITION {partition} FOR VALUES FROM ('{month_start}') TO ('{month_end}')"
+        ))
+        test_db.session.commit()
+
+
+def test_audit_records_api_user(auth_client, ship, test_db):
+    """Тест проверяет, что журнал component_audit получает пользователя из JWT, а настройка не переживает транзакцию."""
+    first, second = ship['component_ids'][:2]
+    response = auth_client.post('/api/components/update_status', json={'updates': [
+        {'component_id': first, 'update_name': 'Осмотр', 'new_status': 'Требует проверки'},
+        {'component_id': second, 'update_name': 'Осмотр', 'new_status': 'Неисправен'},
+    ]})
+    assert response.status_code == 200
+    # Изменение вне API пишется без пользователя: set_config(..., true) действует до конца транзакции
+    test_db.session.execute(text("UPDATE components SET status = 'Рабочий' WHERE id = :id"), {'id': first})
+    test_db.session.commit()
+    rows = test_db.session.execute(text("""
+        SELECT component_id, old_status, new_status, user_id FROM component_audit
+        WHERE component_id = ANY(:ids) AND operation_type = 'UPDATE'
+        ORDER BY change_time, id
+    """), {'ids': [first, second]}).all()
+    assert rows == [
+        (first, 'Рабочий', 'Требует проверки', 1),
+        (second, 'Рабочий', 'Неисправен', 1),
+        (first, 'Требует проверки', 'Рабочий', None),
+    ]
+
+
+def test_history_partition_maintenance(auth_client, test_db):
+    """Тест проверяет /api/ready без будущей секции истории, ее создание обслуживанием и отсоединение устаревших."""
+    next_month = test_db.session.execute(text(
+        "SELECT to_char(date_trunc('month', CURRENT_DATE) + INTERVAL '1 month', 'YYYY_MM')"
+    )).scalar()
+    assert auth_client.get('/api/ready').status_code == 200
+    test_db.session.execute(text(f"DROP TABLE component_audit_p{next_month}"))
+    test_db.session.commit()
+    response = auth_client.get('/api/ready')
+    assert response.status_code == 503 and response.json['reason'] == 'history partitions missing'
+
+    response = auth_client.post('/api/history/maintenance')
+    assert response.status_code == 200 and response.json['created'] >= 1
+    assert auth_client.get('/api/ready').status_code == 200
+
+    # Отсоединение выполняется в транзакции теста и откатывается: проверяется только выбор секций
+    partitions = test_db.session.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent IN ('component_updates'::regclass, 'component_audit'::regclass)
+    """)).scalars().all()
+    current_month = test_db.session.execute(text("SELECT to_char(CURRENT_DATE, 'YYYY_MM')")).scalar()
+    older = sum(1 for name in partitions if name[-7:] < current_month)
+    assert test_db.session.execute(text("SELECT detach_expired_history_partitions(0)")).scalar() == older
+    assert test_db.session.execute(text("SELECT count(*) FROM history_archives WHERE archived_at IS NULL")).scalar() >= older
+    test_db.session.rollback()
+
+
+def test_dashboard_counts_follow_component_changes(auth_client, ship, test_db):
+    """Тест проверяет, что сводка component_status_counts совпадает с components после разных изменений."""
+    first, second, third = ship['component_ids']
+
+    def ship_counts():
+        groups = auth_client.get(f"/api/dashboard?ship_id={ship['id']}").json['groups']
+        return {(g['component_type_id'], status): count
+                for g in groups for status, count in g['counts'].items() if count}
+
+    assert ship_counts() == {(1, 'Рабочий'): 3}
+    assert auth_client.post('/api/components/update_status', json={'updates': [
+        {'component_id': first, 'update_name': 'Осмотр', 'new_status': 'Неисправен'},
+        {'component_id': second, 'update_name': 'Осмотр', 'new_status': 'Неисправен'},
+    ]}).status_code == 200
+    test_db.session.execute(text("UPDATE components SET component_type_id = 2 WHERE id = :id"), {'id': third})
+    test_db.session.commit()
+    assert ship_counts() == {(1, 'Неисправен'): 2, (2, 'Рабочий'): 1}
+    # Ключи с нулевым счетчиком удаляются, а не остаются строками с 0
+    assert test_db.session.execute(text("""
+        SELECT count(*) FROM component_status_counts WHERE ship_id = :ship_id AND component_count = 0
+    """), {'ship_id': ship['id']}).scalar() == 0
+    assert auth_client.post('/api/dashboard/consistency').json['consistent'] is True
+
+    test_db.session.execute(text("""
+        UPDATE component_status_counts SET component_count = 5
+        WHERE ship_id = :ship_id AND component_type_id = 2
+    """), {'ship_id': ship['id']})
+    test_db.session.commit()
+    report = auth_client.post('/api/dashboard/consistency?repair=1').json
+    assert report['repaired'] is True
+    assert [(m['ship_id'], m['expected'], m['actual']) for m in report['mismatches']] == [(ship['id'], 1, 5)]
+    assert ship_counts() == {(1, 'Неисправен'): 2, (2, 'Рабочий'): 1}
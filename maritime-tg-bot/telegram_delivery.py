@@ -0,0 +1,259 @@
+"""Асинхронная доставка сообщений через Telegram Bot API.
+
+Сообщения отправляются параллельно (не больше concurrency одновременно) через общий пул HTTP-соединений.
+Лимиты Telegram соблюдаются двумя ограничителями: общий на бота (global_rate сообщений в секунду)
+и на каждый чат (chat_rate в секунду, для групп - group_rate). Ответ 429 приостанавливает всю отправку
+на retry_after секунд, сетевые ошибки и 5xx повторяются с экспоненциальной задержкой,
+остальные ошибки (бот заблокирован, чат не найден) считаются окончательными.
+"""
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Теги, сущности (&amp;), пробелы и слова: строка режется только между ними
+HTML_TOKEN = re.compile(r'<[^<>]*>|&#?\w+;|\s+|[^<&\s]+|[<&]')
+HTML_TAG = re.compile(r'<(/?)([a-zA-Z][\w-]*)')
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity подряд.
+
+    Состояние защищено threading.Lock, а ожидание идет вне блокировки, поэтому один ограничитель
+    можно разделять между рассылками в разных потоках и циклах событий.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            # За время паузы токены не копятся
+            self.tokens = 0
+            self.updated = self.paused_until
+
+    def try_acquire(self):
+        """Забирает токен и возвращает 0 или сколько секунд подождать до следующей попытки."""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+def split_long_line(line, limit):
+    """Делит строку длиннее limit между словами, не разрывая теги и сущности.
+
+    Теги, открытые на месте разреза, закрываются в конце части и открываются заново в следующей,
+    иначе Telegram отклонит обе части с ошибкой разбора HTML.
+    """
+    parts, current, open_tags = [], '', []
+    # fresh - в части пока только заново открытые теги: разрезать ее еще раз бессмысленно
+    fresh = True
+
+    def closing(tags):
+        return ''.join(f"</{name}>" for name, _ in reversed(tags))
+
+    def reopened():
+        return ''.join(tag for _, tag in open_tags)
+
+    for token in HTML_TOKEN.findall(line):
+        tags = open_tags
+        tag = HTML_TAG.match(token)
+        if tag and tag.group(1):
+            tags = [entry for entry in open_tags if entry[0] != tag.group(2)]
+        elif tag:
+            tags = open_tags + [(tag.group(2), token)]
+        if len(current) + len(token) + len(closing(tags)) > limit and not fresh:
+            parts.append(current.rstrip() + closing(open_tags))
+            current, fresh = reopened(), True
+        if token.isspace() and fresh and parts:
+            continue
+        # Слово длиннее части целиком делится по символам: тегов и сущностей в нем нет
+        while len(current) + len(token) + len(closing(tags)) > limit and not token.startswith(('<', '&')):
+            size = max(1, limit - len(current) - len(closing(tags)))
+            parts.append(current + token[:size] + closing(open_tags))
+            current, token = reopened(), token[size:]
+        current += token
+        open_tags = tags
+        fresh = fresh and bool(tag)
+    parts.append(current)
+    return parts
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Делит текст на части не длиннее limit по границам строк, чтобы не разрывать HTML-теги."""
+    parts, current = [], ''
+    for line in text.split('\n'):
+        if len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ''
+            *complete, line = split_long_line(line, limit)
+            parts.extend(complete)
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+class TelegramDelivery:
+    """Отправляет пачку сообщений и возвращает отчет: sent, failed, retries, rate_limited.
+
+    bucket - общий ограничитель на бота; его стоит передавать, если рассылок несколько,
+    иначе каждая получит собственные global_rate сообщений в секунду.
+    """
+
+    def __init__(self, token, api_url='https://api.telegram.org', concurrency=20, global_rate=25,
+                 chat_rate=1, group_rate=20 / 60, max_retries=5, backoff=1.0, timeout=10, bucket=None):
+        self.url = f"{api_url.rstrip('/')}/bot{token}/sendMessage"
+        self.concurrency = concurrency
+        self.global_rate = global_rate
+        self.bucket = bucket or TokenBucket(global_rate, capacity=max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    async def send_all(self, messages):
+        """messages - пары (chat_id, text). Сообщения одного чата уходят по порядку."""
+        by_chat = OrderedDict()
+        for chat_id, text in messages:
+            by_chat.setdefault(chat_id, []).append(text)
+        return await self.send_stream(by_chat.items())
+
+    async def send_stream(self, chats, on_chat_done=None):
+        """chats - итерируемое пар (chat_id, [тексты]) по одной на чат.
+
+        Читается лениво: следующий чат берется, только когда освобождается место среди concurrency
+        отправляемых, поэтому в памяти одновременно не больше concurrency чатов.
+        on_chat_done(chat_id, delivered) вызывается в отдельном потоке, когда чат обработан целиком;
+        его исключения записываются в лог и не мешают остальным чатам.
+        """
+        report = {'sent': 0, 'failed': [], 'retries': 0, 'rate_limited': 0}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        iterator = iter(chats)
+        tasks = set()
+
+        def finished(task):
+            tasks.discard(task)
+            semaphore.release()
+
+        started = time.monotonic()
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            try:
+                while True:
+                    await semaphore.acquire()
+                    # Источник может читать из БД, поэтому следующий элемент берется в отдельном потоке
+                    item = await asyncio.to_thread(next, iterator, None)
+                    if item is None:
+                        break
+                    task = asyncio.ensure_future(self._send_chat(client, *item, report, on_chat_done))
+                    tasks.add(task)
+                    task.add_done_callback(finished)
+            finally:
+                if tasks:
+                    await asyncio.gather(*tasks)
+        report['seconds'] = round(time.monotonic() - started, 2)
+        return report
+
+    async def _send_chat(self, client, chat_id, texts, report, on_chat_done=None):
+        # Исключение одного чата не должно прервать gather: остальные чаты дошли бы, но без on_chat_done
+        try:
+            delivered = await self._send_parts(client, chat_id, texts, report)
+        except Exception as e:
+            logging.exception(f"Непредвиденная ошибка отправки в чат {chat_id}: {e!r}")
+            report['failed'].append({'chat_id': chat_id, 'error': repr(e), 'messages': len(texts)})
+            delivered = False
+        if on_chat_done:
+            try:
+                await asyncio.to_thread(on_chat_done, chat_id, delivered)
+            except Exception as e:
+                logging.exception(f"Ошибка обработки результата отправки в чат {chat_id}: {e!r}")
+
+    async def _send_parts(self, client, chat_id, texts, report):
+        """Отправляет части по порядку. Возвращает True, если дошли все."""
+        # Группы и каналы имеют отрицательный chat_id и более строгий лимит
+        chat_bucket = TokenBucket(self.group_rate if int(chat_id) < 0 else self.chat_rate)
+        for index, text in enumerate(texts):
+            await chat_bucket.acquire()
+            error = await self._send(client, chat_id, text, report)
+            if error:
+                # После окончательной ошибки остальные части этого чата тоже не дойдут
+                report['failed'].append({'chat_id': chat_id, 'error': error, 'messages': len(texts) - index})
+                return False
+            report['sent'] += 1
+        return True
+
+    async def _send(self, client, chat_id, text, report):
+        """Отправляет одно сообщение с повторами. Возвращает None или описание окончательной ошибки."""
+        payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                response = await client.post(self.url, json=payload)
+            except httpx.HTTPError as e:
+                error = f"сетевая ошибка: {e!r}"
+            else:
+                if response.status_code == 200:
+                    return None
+                description, retry_after = self._parse_error(response)
+                if response.status_code == 429:
+                    report['rate_limited'] += 1
+                    logging.warning(f"Telegram ограничил отправку (чат {chat_id}), пауза {retry_after} с")
+                    self.bucket.pause(retry_after)
+                    if attempt < self.max_retries:
+                        attempt += 1
+                        report['retries'] += 1
+                        continue
+                    return description
+                if response.status_code < 500:
+                    logging.error(f"Ошибка отправки сообщения пользователю {chat_id}: {description}")
+                    return description
+                error = description
+            if attempt >= self.max_retries:
+                logging.error(f"Сообщение пользователю {chat_id} не отправлено после {attempt + 1} попыток: {error}")
+                return error
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+            report['retries'] += 1
+
+    @staticmethod
+    def _parse_error(response):
+        try:
+            data = response.json()
+        except ValueError:
+            return f"HTTP {response.status_code}", 1
+        retry_after = (data.get('parameters') or {}).get('retry_after', 1)
+        return data.get('description') or f"HTTP {response.status_code}", retry_after
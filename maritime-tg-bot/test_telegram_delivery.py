@@ -0,0 +1,164 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram_delivery import TelegramDelivery, TokenBucket, split_message
+
+
+class StubBotAPI(BaseHTTPRequestHandler):
+    """Заменяет Bot API: чат 429 один раз отвечает 429, чат 500 - ошибкой сервера, чат 403 заблокировал бота."""
+    received = []
+    attempts = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        chat_id = payload['chat_id']
+        with self.lock:
+            self.attempts[chat_id] = self.attempts.get(chat_id, 0) + 1
+            attempt = self.attempts[chat_id]
+        if chat_id == 429 and attempt == 1:
+            self.reply(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}})
+        elif chat_id == 500 and attempt <= 2:
+            self.reply(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+        elif chat_id == 403:
+            self.reply(403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'})
+        else:
+            with self.lock:
+                self.received.append((chat_id, payload['text'], time.monotonic()))
+            self.reply(200, {'ok': True, 'result': {'message_id': attempt}})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_delivery_against_stub_bot_api():
+    """Тест проверяет доставку с лимитами, повторами после 429 и 5xx и порядок сообщений в чате."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        delivery = TelegramDelivery('TEST', api_url=f"http://127.0.0.1:{server.server_port}", concurrency=8,
+                                    global_rate=40, chat_rate=10, max_retries=3, backoff=0.05, timeout=5)
+        messages = [(chat_id, f"сообщение {chat_id}") for chat_id in range(1, 101)]
+        messages += [(7, 'вторая часть'), (429, 'после паузы'), (500, 'после ошибок'), (403, 'не дойдет')]
+        started = time.monotonic()
+        report = asyncio.run(delivery.send_all(messages))
+        elapsed = time.monotonic() - started
+    finally:
+        server.shutdown()
+
+    assert report['sent'] == 103
+    assert report['failed'] == [{'chat_id': 403, 'error': 'Forbidden: bot was blocked by the user', 'messages': 1}]
+    assert report['rate_limited'] == 1
+    assert report['retries'] == 3
+    # 429 останавливает всю отправку на retry_after
+    assert elapsed >= 1
+    texts_for_7 = [text for chat_id, text, _ in StubBotAPI.received if chat_id == 7]
+    assert texts_for_7 == ['сообщение 7', 'вторая часть']
+    # Запас ведра - 40 сообщений, поэтому любые 80 подряд занимают не меньше секунды
+    moments = sorted(moment for _, _, moment in StubBotAPI.received)
+    assert all(moments[i + 80] - moments[i] >= 0.95 for i in range(len(moments) - 80))
+
+
+def test_send_stream_reads_chats_lazily():
+    """Тест проверяет, что поток чатов читается по мере отправки, а о каждом доставленном чате сообщается."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Сколько сводок уже было доставлено к моменту чтения очередного чата
+    delivered_at_pull = []
+
+    def chats():
+        for chat_id in range(1001, 1051):
+            delivered_at_pull.append(sum(1 for received_id, _, _ in StubBotAPI.received if received_id > 1000))
+            yield chat_id, [f"сводка {chat_id}"]
+
+    try:
+        delivery = TelegramDelivery('TEST', api_url=f"http://127.0.0.1:{server.server_port}", concurrency=4,
+                                    global_rate=1000, chat_rate=10, timeout=5)
+        done = []
+        report = asyncio.run(delivery.send_stream(chats(), on_chat_done=lambda *args: done.append(args)))
+    finally:
+        server.shutdown()
+
+    assert report['sent'] == 50
+    assert sorted(done) == [(chat_id, True) for chat_id in range(1001, 1051)]
+    # Следующий чат берется, только когда один из concurrency отправляемых завершен
+    assert all(delivered >= index - 4 for index, delivered in enumerate(delivered_at_pull))
+
+
+def test_send_stream_survives_failing_chat_callback():
+    """Тест проверяет, что исключение on_chat_done для одного чата не мешает остальным чатам."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    done = []
+
+    def on_chat_done(chat_id, delivered):
+        if chat_id == 2003:
+            raise RuntimeError("состояние не сохранено")
+        done.append((chat_id, delivered))
+
+    try:
+        delivery = TelegramDelivery('TEST', api_url=f"http://127.0.0.1:{server.server_port}", concurrency=4,
+                                    global_rate=1000, chat_rate=10, timeout=5)
+        chats = [(chat_id, [f"сводка {chat_id}"]) for chat_id in range(2001, 2011)]
+        report = asyncio.run(delivery.send_stream(chats, on_chat_done))
+    finally:
+        server.shutdown()
+
+    assert report['sent'] == 10 and report['failed'] == []
+    assert sorted(done) == [(chat_id, True) for chat_id in range(2001, 2011) if chat_id != 2003]
+
+
+def test_token_bucket_shared_between_event_loops():
+    """Тест проверяет, что один ограничитель держит общий лимит для рассылок в разных потоках."""
+    bucket = TokenBucket(rate=40, capacity=1)
+    acquired = []
+
+    async def take(count):
+        for _ in range(count):
+            await bucket.acquire()
+            acquired.append(time.monotonic())
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=asyncio.run, args=(take(10),)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 20 токенов при 40 в секунду и емкости 1: не быстрее чем за 19/40 с
+    assert len(acquired) == 20
+    assert max(acquired) - started >= 19 / 40 * 0.95
+
+
+def test_split_message_keeps_lines():
+    """Тест проверяет, что длинная сводка делится по строкам в пределах лимита Telegram."""
+    lines = [f"<b>Компонент {i}</b> осталось {i} дн." for i in range(500)]
+    parts = split_message('\n'.join(lines), limit=1000)
+    assert all(len(part) <= 1000 for part in parts)
+    assert '\n'.join(parts).split('\n') == lines
+
+
+def test_split_message_long_line_keeps_tags():
+    """Тест проверяет деление строки длиннее лимита между словами с закрытием и повторным открытием тегов."""
+    line = "<b>" + " ".join(f"слово{i}" for i in range(300)) + "</b> &amp; конец"
+    parts = split_message(f"Заголовок\n{line}", limit=200)
+    assert parts[0] == "Заголовок" and parts[1].startswith("<b>слово0 ")
+    for part in parts:
+        assert len(part) <= 200
+        assert part.count('<b>') == part.count('</b>')
+        # Вне целых тегов и сущностей не остается ни '<', ни '&'
+        assert not set('<>&') & set(re.sub(r'</?b>|&amp;', '', part))
+    words = re.sub(r'</?b>', '', ' '.join(parts)).split()
+    assert words == ['Заголовок'] + [f"слово{i}" for i in range(300)] + ['&amp;', 'конец']
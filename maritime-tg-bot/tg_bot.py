@@ -1,16 +1,21 @@
 import os
-import requests
+import asyncio
+import html
 import schedule
 import time
 import logging
-from threading import Thread
+from contextlib import contextmanager
+from threading import Thread, Lock, BoundedSemaphore
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime, timedelta
 
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
+from telegram_delivery import TelegramDelivery, TokenBucket, split_message
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -20,19 +25,60 @@ load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 DATABASE_URL = os.getenv('DATABASE_URL')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+# Telegram допускает ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv('TELEGRAM_SEND_CONCURRENCY', 20))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 25))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', 5))
+# Ежедневной рассылке нужно два соединения (курсор сводок и запись состояния), срочным уведомлениям - одно
+BOT_DB_POOL_SIZE = int(os.getenv('BOT_DB_POOL_SIZE', 3))
+# Сколько секунд ждать свободного соединения, когда все BOT_DB_POOL_SIZE заняты
+BOT_DB_POOL_TIMEOUT = float(os.getenv('BOT_DB_POOL_TIMEOUT', 30))
+# Сколько изменений показывать в сводке и сколько сводок читать из БД за раз
+NOTIFICATION_DIGEST_LIMIT = int(os.getenv('NOTIFICATION_DIGEST_LIMIT', 50))
+NOTIFICATION_FETCH_SIZE = int(os.getenv('NOTIFICATION_FETCH_SIZE', 100))
+# Срочные уведомления: события NOTIFY за ALERT_COALESCE_SECONDS объединяются в одну рассылку
+ALERT_CHANNEL = 'component_alerts'
+ALERT_STATUSES = ['Неисправен', 'Требует проверки']
+ALERT_COALESCE_SECONDS = float(os.getenv('ALERT_COALESCE_SECONDS', 2))
+ALERT_RECONNECT_SECONDS = float(os.getenv('ALERT_RECONNECT_SECONDS', 10))
 
 if not TELEGRAM_BOT_TOKEN or not DATABASE_URL:
     logging.critical("Критическая ошибка: не найдены переменные окружения TELEGRAM_BOT_TOKEN или DATABASE_URL. Бот не может быть запущен.")
     exit()
 
-def get_db_connection():
-    """Устанавливает и возвращает соединение с базой данных."""
+db_pool = None
+db_pool_lock = Lock()
+# ThreadedConnectionPool сразу бросает PoolError, если все соединения выданы; семафор заставляет ждать
+db_pool_slots = BoundedSemaphore(BOT_DB_POOL_SIZE)
+state_lock = Lock()
+
+def get_db_pool():
+    """Создает пул соединений с базой данных при первом обращении."""
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            db_pool = ThreadedConnectionPool(1, BOT_DB_POOL_SIZE, DATABASE_URL)
+        return db_pool
+
+@contextmanager
+def db_connection():
+    """Выдает соединение из пула и возвращает его обратно (незавершенная транзакция откатывается).
+
+    Если свободных соединений нет, ждет до BOT_DB_POOL_TIMEOUT секунд.
+    """
+    pool = get_db_pool()
+    if not db_pool_slots.acquire(timeout=BOT_DB_POOL_TIMEOUT):
+        raise PoolError(f"нет свободного соединения с БД за {BOT_DB_POOL_TIMEOUT} с")
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except psycopg2.OperationalError as e:
-        logging.error(f"Ошибка подключения к базе данных: {e}")
-        return None
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn)
+    finally:
+        db_pool_slots.release()
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отправляет пользователю его Telegram ID."""
@@ -50,155 +96,426 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_html(reply_text)
 
-def send_telegram_message(chat_id, text):
-    """Отправляет отформатированное сообщение в Telegram."""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        if response.status_code != 200:
-            logging.error(f"Ошибка отправки сообщения пользователю {chat_id}: {response.text}")
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Сетевая ошибка при отправке сообщения: {e}")
-
-def get_expiring_components_from_db():
-    """Получает компоненты с истекающим сроком напрямую из БД, включая IMO судна."""
-    conn = get_db_connection()
-    if not conn:
-        return None
-        
-    query = """
-    SELECT 
-        c.name,
-        c.serial_number,
-        c.component_type_id,
-        s.imo_number, -- Добавляем IMO номер
-        s.name AS ship_name, -- И имя корабля
-        (c.last_inspection_date + (c.service_life_months * INTERVAL '1 month')) AS expiration_date,
-        EXTRACT(DAY FROM (c.last_inspection_date + (c.service_life_months * INTERVAL '1 month')) - CURRENT_DATE)::integer AS days_remaining
-    FROM components c
-    JOIN ships s ON c.ship_id = s.id -- Присоединяем таблицу с кораблями
-    WHERE 
-        c.status = 'Рабочий' 
-        AND
-        (c.last_inspection_date + (c.service_life_months * INTERVAL '1 month'))
-        BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '90 day';
-    """
-    try:
-        with conn.cursor() as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
-            components = [
-                {
-                    "name": row[0],
-                    "serial_number": row[1],
-                    "component_type_id": row[2],
-                    "imo_number": row[3],
-                    "ship_name": row[4],
-                    "expiration_date": row[5].strftime('%Y-%m-%d'),
-                    "days_remaining": row[6]
-                }
-                for row in rows
-            ]
-            return components
-    except Exception as e:
-        logging.error(f"Ошибка выполнения SQL-запроса на получение компонентов: {e}")
-        return None
-    finally:
-        if conn:
-            conn.close()
+# Один ограничитель на бота: ежедневная сводка и срочные уведомления могут идти одновременно
+telegram_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, capacity=max(1, int(TELEGRAM_GLOBAL_RATE)))
 
-def get_all_subscriptions_from_db():
-    """Получает все подписки пользователей напрямую из БД."""
-    conn = get_db_connection()
-    if not conn:
-        return None
+def create_delivery():
+    return TelegramDelivery(
+        TELEGRAM_BOT_TOKEN,
+        api_url=TELEGRAM_API_URL,
+        concurrency=TELEGRAM_SEND_CONCURRENCY,
+        global_rate=TELEGRAM_GLOBAL_RATE,
+        chat_rate=TELEGRAM_CHAT_RATE,
+        max_retries=TELEGRAM_MAX_RETRIES,
+        bucket=telegram_bucket,
+    )
+
+# Подписчик отписался от типа или убрал telegram_id из профиля: такие компоненты забываются молча.
+# Удаленные компоненты остаются, чтобы попасть в сводку как снятые с контроля
+NOTIFICATION_PRUNE_QUERY = """
+WITH subscriptions AS (
+    SELECT DISTINCT u.telegram_id, cs.component_type_id
+    FROM component_subscriptions cs
+    JOIN users u ON cs.user_id = u.id
+    WHERE u.telegram_id IS NOT NULL
+),
+stale AS (
+    SELECT ns.telegram_id, ns.component_id
+    FROM notification_state ns
+    LEFT JOIN components c ON c.id = ns.component_id
+    LEFT JOIN subscriptions s ON s.telegram_id = ns.telegram_id AND s.component_type_id = c.component_type_id
+    WHERE s.telegram_id IS NULL
+      AND (c.id IS NOT NULL OR NOT EXISTS (SELECT 1 FROM subscriptions s2 WHERE s2.telegram_id = ns.telegram_id))
+)
+DELETE FROM notification_state ns
+USING stale
+WHERE ns.telegram_id = stale.telegram_id AND ns.component_id = stale.component_id;
+"""
 
-    query = """
-    SELECT u.telegram_id, cs.component_type_id
+# Изменения с прошлой рассылки, по строке на подписчика: новые компоненты (или с перенесенным сроком),
+# пересечение порога 90/30/7/0 дней и снятые с контроля (заменены, списаны, срок продлен).
+# В сообщение попадают первые limit изменений, массивы нужны, чтобы после доставки
+# записать в notification_state ровно то, что было отправлено.
+NOTIFICATION_DELTA_QUERY = """
+WITH subscriptions AS (
+    SELECT DISTINCT u.telegram_id, cs.component_type_id
     FROM component_subscriptions cs
     JOIN users u ON cs.user_id = u.id
-    WHERE u.telegram_id IS NOT NULL;
+    WHERE u.telegram_id IS NOT NULL
+),
+expiring AS (
+    SELECT s.telegram_id, c.id AS component_id, c.expiration_date,
+           notification_tier(c.expiration_date - CURRENT_DATE) AS tier
+    FROM subscriptions s
+    JOIN components c ON c.component_type_id = s.component_type_id
+    WHERE c.status = 'Рабочий'
+      AND c.expiration_date BETWEEN CURRENT_DATE AND CURRENT_DATE + 90
+),
+changes AS (
+    SELECT e.telegram_id, e.component_id, e.expiration_date, e.tier,
+           CASE WHEN ns.expiration_date = e.expiration_date THEN 'tier' ELSE 'new' END AS change
+    FROM expiring e
+    LEFT JOIN notification_state ns ON ns.telegram_id = e.telegram_id AND ns.component_id = e.component_id
+    WHERE ns.expiration_date IS DISTINCT FROM e.expiration_date OR e.tier < ns.tier
+    UNION ALL
+    -- Отправленные раньше и больше не истекающие. Просроченный, но не замененный компонент
+    -- не снят с контроля: о нем сообщается один раз, как о пересечении порога 0
+    SELECT ns.telegram_id, ns.component_id, c.expiration_date,
+           CASE WHEN o.overdue THEN 0 END::smallint,
+           CASE WHEN o.overdue THEN 'tier' ELSE 'resolved' END
+    FROM notification_state ns
+    LEFT JOIN components c ON c.id = ns.component_id
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(c.status = 'Рабочий' AND c.expiration_date = ns.expiration_date
+                        AND c.expiration_date < CURRENT_DATE, false) AS overdue
+    ) o
+    WHERE NOT EXISTS (
+        SELECT 1 FROM expiring e WHERE e.telegram_id = ns.telegram_id AND e.component_id = ns.component_id
+    )
+      AND NOT (o.overdue AND ns.tier = 0)
+),
+ranked AS (
+    SELECT ch.*,
+           row_number() OVER (PARTITION BY ch.telegram_id
+                              ORDER BY ch.change = 'resolved', ch.expiration_date, ch.component_id) AS position
+    FROM changes ch
+),
+summary AS (
+    SELECT telegram_id,
+           count(*) AS total,
+           array_agg(component_id) FILTER (WHERE change <> 'resolved') AS notified_ids,
+           array_agg(tier) FILTER (WHERE change <> 'resolved') AS tiers,
+           array_agg(expiration_date) FILTER (WHERE change <> 'resolved') AS expiration_dates,
+           array_agg(component_id) FILTER (WHERE change = 'resolved') AS resolved_ids
+    FROM ranked
+    GROUP BY telegram_id
+),
+listed AS (
+    SELECT r.telegram_id,
+           json_agg(json_build_object(
+               'change', r.change,
+               'component_id', r.component_id,
+               'name', c.name,
+               'serial_number', c.serial_number,
+               'ship_name', sh.name,
+               'imo_number', sh.imo_number,
+               'expiration_date', r.expiration_date,
+               'days_remaining', r.expiration_date - CURRENT_DATE
+           ) ORDER BY r.position) AS changes
+    FROM ranked r
+    LEFT JOIN components c ON c.id = r.component_id
+    LEFT JOIN ships sh ON sh.id = c.ship_id
+    WHERE r.position <= %(limit)s
+    GROUP BY r.telegram_id
+)
+SELECT s.telegram_id, s.total, l.changes, s.notified_ids, s.tiers, s.expiration_dates, s.resolved_ids
+FROM summary s
+JOIN listed l ON l.telegram_id = s.telegram_id
+ORDER BY s.telegram_id;
+"""
+
+SAVE_NOTIFICATION_STATE_QUERY = """
+INSERT INTO notification_state (telegram_id, component_id, tier, expiration_date)
+SELECT %(telegram_id)s, n.component_id, n.tier, n.expiration_date
+FROM unnest(%(ids)s::integer[], %(tiers)s::smallint[], %(dates)s::date[]) AS n(component_id, tier, expiration_date)
+ON CONFLICT (telegram_id, component_id) DO UPDATE
+SET tier = EXCLUDED.tier, expiration_date = EXCLUDED.expiration_date, notified_at = CURRENT_TIMESTAMP;
+"""
+
+def prune_notification_state():
+    """Удаляет состояние по подпискам, которых больше нет. Возвращает число удаленных строк."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(NOTIFICATION_PRUNE_QUERY)
+            pruned = cur.rowcount
+        conn.commit()
+    return pruned
+
+def iter_notification_deltas():
+    """Читает изменения серверным курсором порциями по NOTIFICATION_FETCH_SIZE, по строке на подписчика."""
+    with db_connection() as conn:
+        # Именованный курсор живет на сервере, клиент держит в памяти только текущую порцию
+        with conn.cursor(name='notification_deltas') as cur:
+            cur.itersize = NOTIFICATION_FETCH_SIZE
+            cur.execute(NOTIFICATION_DELTA_QUERY, {'limit': NOTIFICATION_DIGEST_LIMIT})
+            yield from cur
+
+def save_notification_state(telegram_id, notified_ids, tiers, expiration_dates, resolved_ids):
+    """Записывает доставленные подписчику изменения в notification_state."""
+    # Курсор рассылки держит одно соединение пула, записи идут по очереди через второе
+    with state_lock, db_connection() as conn:
+        with conn.cursor() as cur:
+            if notified_ids:
+                cur.execute(SAVE_NOTIFICATION_STATE_QUERY, {
+                    'telegram_id': telegram_id, 'ids': notified_ids, 'tiers': tiers, 'dates': expiration_dates
+                })
+            if resolved_ids:
+                cur.execute(
+                    "DELETE FROM notification_state WHERE telegram_id = %s AND component_id = ANY(%s)",
+                    (telegram_id, resolved_ids)
+                )
+        conn.commit()
+
+def escape_field(comp, key):
+    # Сообщения уходят с parse_mode=HTML: значения из БД экранируются, чтобы '<' или '&' не ломали разметку
+    value = comp.get(key)
+    return 'N/A' if value is None else html.escape(str(value))
+
+def format_notification_message(changes, total=None):
+    """Форматирует сводку изменений; total - сколько всего изменений, если показаны не все."""
+    if not changes: return None
+    expiring = [comp for comp in changes if comp['change'] != 'resolved']
+    resolved = [comp for comp in changes if comp['change'] == 'resolved']
+    text_parts = []
+    if expiring:
+        text_parts.append("<b>Уведомление о компонентах с истекающим сроком:</b>\n")
+        for comp in expiring:
+            if comp['days_remaining'] < 0:
+                deadline = f"Срок истек: {comp['expiration_date']}"
+            else:
+                deadline = f"Срок истекает: {comp['expiration_date']} (осталось {comp['days_remaining']} дн.)"
+            part = (
+                f"\n- <b>{escape_field(comp, 'name')}</b> (SN: {escape_field(comp, 'serial_number')})\n"
+                f"  Судно: {escape_field(comp, 'ship_name')} (IMO: {escape_field(comp, 'imo_number')})\n"
+                f"  <i>{deadline}</i>"
+            )
+            text_parts.append(part)
+    if resolved:
+        header = "<b>Сняты с контроля (заменены, списаны или срок продлен):</b>\n"
+        text_parts.append(f"\n{header}" if expiring else header)
+        for comp in resolved:
+            if comp['name'] is None:
+                text_parts.append(f"\n- Компонент #{comp['component_id']} удален")
+            else:
+                text_parts.append(
+                    f"\n- <b>{escape_field(comp, 'name')}</b> (SN: {escape_field(comp, 'serial_number')})\n"
+                    f"  Судно: {escape_field(comp, 'ship_name')} (IMO: {escape_field(comp, 'imo_number')})"
+                )
+    if total and total > len(changes):
+        text_parts.append(f"\n...и еще {total - len(changes)} изменений. Полный список доступен на сайте.")
+    return "\n".join(text_parts)
+
+def iter_notification_messages(stats, pending):
+    """Превращает поток изменений в пары (telegram_id, части сообщения) для отправки."""
+    for telegram_id, total, changes, *state in iter_notification_deltas():
+        stats['subscribers'] += 1
+        stats['changes'] += total
+        # Состояние запишется, только когда сообщение дойдет целиком
+        pending[telegram_id] = [values or [] for values in state]
+        # Длинные сводки делятся на части по лимиту Telegram в 4096 символов
+        yield telegram_id, split_message(format_notification_message(changes, total))
+
+def check_and_send_notifications():
+    """Главная функция проверки и отправки уведомлений.
+
+    Отправляются только изменения с прошлой рассылки, а состояние сохраняется по каждому доставленному
+    чату, поэтому повторный или прерванный и перезапущенный прогон не дублирует сообщения.
     """
+    logging.info("Запуск проверки уведомлений...")
+    stats = {'subscribers': 0, 'changes': 0}
+    pending = {}
+
+    def on_chat_done(telegram_id, delivered):
+        state = pending.pop(telegram_id)
+        if not delivered:
+            return
+        try:
+            save_notification_state(telegram_id, *state)
+        except psycopg2.Error as e:
+            # Остальные чаты продолжают отправляться; этот получит изменения повторно в следующий прогон
+            logging.error(f"Не удалось сохранить состояние уведомлений для {telegram_id}: {e}")
+
     try:
+        pruned = prune_notification_state()
+        if pruned:
+            logging.info(f"Удалено устаревших записей состояния уведомлений: {pruned}")
+        report = asyncio.run(create_delivery().send_stream(iter_notification_messages(stats, pending), on_chat_done))
+    except psycopg2.Error as e:
+        logging.error(f"Ошибка выполнения SQL-запроса при рассылке уведомлений: {e}")
+        return
+
+    if not stats['subscribers']:
+        logging.info("Проверка завершена. Изменений с прошлой рассылки нет.")
+        return
+    logging.info(
+        f"Проверка завершена. Сводок: {stats['subscribers']} (изменений в них: {stats['changes']}), "
+        f"отправлено сообщений: {report['sent']}, не доставлено чатам: {len(report['failed'])}, "
+        f"повторов: {report['retries']}, ответов 429: {report['rate_limited']}, время: {report['seconds']} с."
+    )
+
+# Срочные уведомления по id из NOTIFY: компонент должен и сейчас быть в тревожном статусе,
+# иначе его успели исправить за время объединения событий
+COMPONENT_ALERTS_QUERY = """
+WITH subscriptions AS (
+    SELECT DISTINCT u.telegram_id, cs.component_type_id
+    FROM component_subscriptions cs
+    JOIN users u ON cs.user_id = u.id
+    WHERE u.telegram_id IS NOT NULL
+),
+alerts AS (
+    SELECT s.telegram_id, c.id, c.name, c.serial_number, c.status, c.ship_id,
+           row_number() OVER (PARTITION BY s.telegram_id ORDER BY c.id) AS position,
+           count(*) OVER (PARTITION BY s.telegram_id) AS total
+    FROM components c
+    JOIN subscriptions s ON s.component_type_id = c.component_type_id
+    WHERE c.id = ANY(%(ids)s)
+      AND c.status = ANY(%(statuses)s)
+)
+SELECT a.telegram_id, a.total,
+       json_agg(json_build_object(
+           'name', a.name,
+           'serial_number', a.serial_number,
+           'status', a.status,
+           'ship_name', sh.name,
+           'imo_number', sh.imo_number,
+           'update_name', lu.update_name,
+           'notes', lu.notes
+       ) ORDER BY a.position) AS components
+FROM alerts a
+JOIN ships sh ON sh.id = a.ship_id
+LEFT JOIN LATERAL (
+    SELECT cu.update_name, cu.notes
+    FROM component_updates cu
+    WHERE cu.component_id = a.id
+    ORDER BY cu.update_date DESC, cu.id DESC
+    LIMIT 1
+) lu ON true
+WHERE a.position <= %(limit)s
+GROUP BY a.telegram_id, a.total
+ORDER BY a.telegram_id;
+"""
+
+def get_component_alerts(component_ids):
+    """Возвращает срочные уведомления по компонентам: (telegram_id, всего, первые компоненты)."""
+    with db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
-            
-            subscriptions_by_user = {}
-            for telegram_id, component_type_id in rows:
-                if telegram_id not in subscriptions_by_user:
-                    subscriptions_by_user[telegram_id] = []
-                subscriptions_by_user[telegram_id].append(component_type_id)
-            
-            return [
-                {"telegram_id": tid, "subscribed_type_ids": types}
-                for tid, types in subscriptions_by_user.items()
-            ]
-
-    except Exception as e:
-        logging.error(f"Ошибка выполнения SQL-запроса на получение подписок: {e}")
-        return None
-    finally:
-        if conn:
-            conn.close()
+            cur.execute(COMPONENT_ALERTS_QUERY, {
+                'ids': component_ids, 'statuses': ALERT_STATUSES, 'limit': NOTIFICATION_DIGEST_LIMIT
+            })
+            return cur.fetchall()
 
-def format_notification_message(components):
-    """Форматирует сообщение для отправки."""
-    if not components: return None
-    text_parts = ["<b>Уведомление о компонентах с истекающим сроком:</b>\n"]
+def format_alert_message(components, total=None):
+    """Форматирует срочное уведомление об изменении статуса."""
+    text_parts = ["<b>Срочно: компоненты требуют внимания</b>\n"]
     for comp in components:
         part = (
-            f"\n- <b>{comp['name']}</b> (SN: {comp.get('serial_number', 'N/A')})\n"
-            f"  Судно: {comp.get('ship_name', 'N/A')} (IMO: {comp.get('imo_number', 'N/A')})\n"
-            f"  <i>Срок истекает: {comp['expiration_date']} (осталось {comp['days_remaining']} дн.)</i>"
+            f"\n- <b>{escape_field(comp, 'name')}</b> (SN: {escape_field(comp, 'serial_number')})\n"
+            f"  Судно: {escape_field(comp, 'ship_name')} (IMO: {escape_field(comp, 'imo_number')})\n"
+            f"  <i>Статус: {escape_field(comp, 'status')}</i>"
         )
+        if comp.get('update_name'):
+            part += f"\n  Последняя запись: {html.escape(comp['update_name'])}"
+            if comp.get('notes'):
+                part += f" ({html.escape(comp['notes'])})"
         text_parts.append(part)
+    if total and total > len(components):
+        text_parts.append(f"\n...и еще {total - len(components)} компонентов. Полный список доступен на сайте.")
     return "\n".join(text_parts)
 
-def check_and_send_notifications():
-    """Главная функция проверки и отправки уведомлений."""
-    logging.info("Запуск проверки уведомлений...")
-    
-    expiring_components = get_expiring_components_from_db()
-    
-    if not expiring_components:
-        logging.info("Нет компонентов с истекающим сроком или произошла ошибка БД.")
-        return
-    logging.info(f"Найдено компонентов с истекающим сроком: {len(expiring_components)}")
-
-    expiring_by_type = {}
-    for comp in expiring_components:
-        type_id = comp['component_type_id']
-        if type_id not in expiring_by_type:
-            expiring_by_type[type_id] = []
-        expiring_by_type[type_id].append(comp)
-
-    subscriptions = get_all_subscriptions_from_db()
-    if not subscriptions:
-        logging.info("Нет активных подписок или произошла ошибка БД.")
-        return
-    logging.info(f"Найдено пользователей с подписками: {len(subscriptions)}")
-
-    total_sent = 0
-    for user_sub in subscriptions:
-        telegram_id = user_sub['telegram_id']
-        components_to_notify = []
-        
-        for type_id in user_sub['subscribed_type_ids']:
-            if type_id in expiring_by_type:
-                components_to_notify.extend(expiring_by_type[type_id])
-
-        if components_to_notify:
-            unique_components = {c['name'] + c['serial_number']: c for c in components_to_notify}.values()
-            
-            message = format_notification_message(list(unique_components))
-            if message:
-                logging.info(f"Отправка {len(unique_components)} уведомлений пользователю {telegram_id}...")
-                send_telegram_message(telegram_id, message)
-                total_sent += 1
-                
-    logging.info(f"Проверка завершена. Отправлено уведомлений: {total_sent}.")
+class AlertListener:
+    """Слушает LISTEN component_alerts в цикле событий бота и рассылает срочные уведомления.
+
+    Соединение psycopg2 неблокирующе опрашивается через loop.add_reader. События копятся
+    ALERT_COALESCE_SECONDS, после чего все накопленные id обрабатываются одним запросом;
+    при обрыве соединение восстанавливается через ALERT_RECONNECT_SECONDS.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.fd = None
+        self.loop = None
+        self.pending = set()
+        self.flush_handle = None
+        self.flush_lock = None
+        self.reconnect_handle = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        # В Python 3.9 asyncio.Lock привязывается к циклу при создании
+        self.flush_lock = asyncio.Lock()
+        await self.connect()
+
+    def stop(self):
+        for handle in (self.flush_handle, self.reconnect_handle):
+            if handle:
+                handle.cancel()
+        self.disconnect()
+
+    def schedule_reconnect(self):
+        self.reconnect_handle = self.loop.call_later(
+            ALERT_RECONNECT_SECONDS, lambda: asyncio.ensure_future(self.connect())
+        )
+
+    @staticmethod
+    def open_connection():
+        conn = psycopg2.connect(DATABASE_URL)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {ALERT_CHANNEL};")
+        return conn
+
+    async def connect(self):
+        self.reconnect_handle = None
+        try:
+            # Подключение блокирующее (DNS, TCP, аутентификация), поэтому выполняется вне цикла событий
+            conn = await self.loop.run_in_executor(None, self.open_connection)
+        except psycopg2.Error as e:
+            logging.error(f"Не удалось подписаться на срочные уведомления: {e}")
+            self.schedule_reconnect()
+            return
+        self.conn, self.fd = conn, conn.fileno()
+        self.loop.add_reader(self.fd, self.on_readable)
+        logging.info(f"Подписка на срочные уведомления (LISTEN {ALERT_CHANNEL}) установлена.")
+
+    def disconnect(self):
+        if self.conn:
+            self.loop.remove_reader(self.fd)
+            self.conn.close()
+            self.conn = None
+
+    def on_readable(self):
+        try:
+            self.conn.poll()
+        except psycopg2.Error as e:
+            logging.error(f"Соединение для срочных уведомлений потеряно: {e}")
+            self.disconnect()
+            self.schedule_reconnect()
+            return
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            self.pending.update(int(value) for value in notify.payload.split(',') if value.isdigit())
+        if self.pending and not self.flush_handle:
+            self.flush_handle = self.loop.call_later(
+                ALERT_COALESCE_SECONDS, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        self.flush_handle = None
+        # Рассылки идут по очереди, события во время отправки соберутся в следующую
+        async with self.flush_lock:
+            component_ids, self.pending = sorted(self.pending), set()
+            if not component_ids:
+                return
+            try:
+                alerts = await asyncio.to_thread(get_component_alerts, component_ids)
+                messages = [(telegram_id, split_message(format_alert_message(components, total)))
+                            for telegram_id, total, components in alerts]
+                report = await create_delivery().send_stream(messages)
+            except Exception as e:
+                logging.error(f"Ошибка рассылки срочных уведомлений: {e}")
+                return
+            logging.info(
+                f"Срочные уведомления: компонентов {len(component_ids)}, получателей {len(alerts)}, "
+                f"отправлено сообщений: {report['sent']}, не доставлено чатам: {len(report['failed'])}."
+            )
+
+alert_listener = AlertListener()
+
+async def start_alert_listener(application):
+    await alert_listener.start()
+
+async def stop_alert_listener(application):
+    alert_listener.stop()
 
 def run_scheduler():
     """Функция планировщика."""
@@ -215,7 +532,14 @@ def main():
     scheduler_thread = Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
     
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Срочные уведомления слушаются в том же цикле событий, что и команды бота
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(start_alert_listener)
+        .post_shutdown(stop_alert_listener)
+        .build()
+    )
     application.add_handler(CommandHandler("start", start_command))
 
     logging.info("Бот запущен и готов принимать команды.")